@@ -0,0 +1,46 @@
+"""
+Memory and throughput benchmark of Box objects.
+
+    python benchmarks/bench_bbox.py
+"""
+from __future__ import division, print_function
+
+import timeit
+import tracemalloc
+
+from cv_utils import Box
+
+N = 100000
+REPEAT = 5
+
+
+def memory_per_box(n=N):
+    tracemalloc.start()
+    boxes = [Box(i, i + 1, 10.4, 20.6) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del boxes
+    # exclude the list of references
+    return size / n - 8
+
+
+def throughput(stmt, n=N):
+    t = min(timeit.repeat(stmt, number=n, repeat=REPEAT,
+                          setup='from cv_utils import Box; b = Box(5, 7, 10.4, 20.6)'))
+    return n / t
+
+
+def main():
+    print('memory per box: {:.1f} bytes'.format(memory_per_box()))
+    for name, stmt in [('Box()', 'Box(1, 2, 3, 4)'),
+                       ('from_xy', 'Box.from_xy(1, 2, 3, 4)'),
+                       ('move', 'b.move((3, 4))'),
+                       ('move reverse', 'b.move((3, 4), True)'),
+                       ('expand', 'b.expand(10)'),
+                       ('padding', 'b.padding(5)'),
+                       ('to_int', 'b.to_int()')]:
+        print('{:14s} {:12,.0f} ops/s'.format(name, throughput(stmt)))
+
+
+if __name__ == '__main__':
+    main()
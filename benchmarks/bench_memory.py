@@ -0,0 +1,294 @@
+"""
+Peak memory of the public functions of img_utils, template_matching and feature_extractor
+at several input sizes.
+
+Peak is measured with tracemalloc (numpy and OpenCV outputs are allocated through python)
+and by sampling the RSS of the process. (Linux only)
+
+Record a baseline on the target machine, then compare later runs against it.
+A run fails (exit code 1) if the tracemalloc peak of a case grows beyond the tolerance,
+if a case raises, or if a case of the baseline is not measured any more.
+
+Not measured:
+    - feature_extractor.deep: needs caffe and a network model
+    - img_utils.show_img, imshow: display only
+    - is_gray, factory, feature_key, search_region, jpeg_size, enable_cache, disable_cache:
+      no image sized allocations
+
+    python benchmarks/bench_memory.py --save
+    python benchmarks/bench_memory.py --tolerance 0.1
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+from cv_utils import Box, ViewBox, Label, img_utils, template_matching as tm, feature_extractor as fe
+
+SIZES = (256, 512, 1024)
+BASELINE = os.path.join(os.path.dirname(__file__), 'memory_baseline.json')
+
+
+def _image(side, seed=0):
+    rng = np.random.RandomState(seed)
+    img = np.full((side, side, 3), 255, dtype=np.uint8)
+    pad = side // 8
+    img[pad:-pad, pad:-pad] = rng.randint(0, 200, (side - 2 * pad, side - 2 * pad, 3))
+    return img
+
+
+def cases(side, tmp_dir):
+    """
+    :param side: Side of the square search image
+    :param tmp_dir: Directory for the input files (images and video)
+    :return: List of (name, function to measure) for the input size
+    """
+    img = _image(side)
+    tmpl_box = Box(side // 4, side // 4, side // 4, side // 4)
+    template = img_utils.img_box(img, tmpl_box).copy()
+    hog_op = dict(feature='hog')
+    multi_op = dict(features=[dict(feature='hog'), dict(feature='lab')])
+    hog_t, hog_i = tm.extract(template, hog_op), tm.extract(img, hog_op)
+    quantized = fe.quantize(hog_i)
+    proj = fe.Projection.fit([hog_i], 3)
+    small = [_image(side // 4, seed) for seed in range(4)]
+    vbox = ViewBox(tmpl_box, labels=[Label((0, 0), 'label')])
+
+    img_dir = os.path.join(tmp_dir, str(side))
+    os.makedirs(img_dir)
+    fname = os.path.join(img_dir, 'image.jpg')
+    cv.imwrite(fname, img)
+    video = os.path.join(tmp_dir, '{}.avi'.format(side))
+    writer = cv.VideoWriter(video, cv.VideoWriter_fourcc(*'MJPG'), 10, (side, side))
+    for _ in range(10):
+        writer.write(img)
+    writer.release()
+
+    return [
+        ('img_utils.remove_bg', lambda: img_utils.remove_bg(img)),
+        ('img_utils.add_bg', lambda: img_utils.add_bg(img, 10)),
+        ('img_utils.pad', lambda: img_utils.pad(img, [10, 20, 10, 20])),
+        ('img_utils.pad_many', lambda: img_utils.pad_many(small, 10)),
+        ('img_utils.crop_many', lambda: img_utils.crop_many(img, [tmpl_box] * 16)),
+        ('img_utils.img_box', lambda: img_utils.img_box(img, tmpl_box)),
+        ('img_utils.set_img_box', lambda: img_utils.set_img_box(img.copy(), tmpl_box, 0)),
+        ('img_utils.set_img_boxes', lambda: img_utils.set_img_boxes(img.copy(), [tmpl_box] * 16, 0)),
+        ('img_utils.add_rect', lambda: img_utils.add_rect(img.copy(), tmpl_box)),
+        ('img_utils.add_text_img', lambda: img_utils.add_text_img(img.copy(), 'text', (10, 10))),
+        ('img_utils.add_view_box', lambda: img_utils.add_view_box(img.copy(), vbox)),
+        ('img_utils.collage', lambda: img_utils.collage([small[:2], small[2:]], (2, 2))),
+        ('img_utils.repeat', lambda: img_utils.repeat(small[0], (2, 2))),
+        ('img_utils.gray3', lambda: img_utils.gray3(img)),
+        ('img_utils.gray3ch', lambda: img_utils.gray3ch(img[:, :, 0])),
+        ('img_utils.imread', lambda: img_utils.imread(fname)),
+        ('img_utils.imread_max_side', lambda: img_utils.imread(fname, side // 4)),
+        ('img_utils.each_img', lambda: list(img_utils.each_img(img_dir))),
+        ('img_utils.each_frame', lambda: sum(1 for _ in img_utils.each_frame(video))),
+        ('img_utils.resize_max', lambda: img_utils.resize_max(img, side // 2)),
+        ('img_utils.contrast', lambda: img_utils.contrast(img, 1.5)),
+        ('img_utils.brightness', lambda: img_utils.brightness(img, 1.5)),
+        ('img_utils.rot90', lambda: img_utils.rot90(img)),
+        ('img_utils.rotate', lambda: img_utils.rotate(img, 30)),
+        ('img_utils.randomly_place', lambda: img_utils.randomly_place(img, template)),
+        ('feature_extractor.hog', lambda: fe.hog(img)),
+        ('feature_extractor.gray', lambda: fe.gray(img)),
+        ('feature_extractor.lab', lambda: fe.lab(img)),
+        ('feature_extractor.luv', lambda: fe.luv(img)),
+        ('feature_extractor.hsv', lambda: fe.hsv(img)),
+        ('feature_extractor.hls', lambda: fe.hls(img)),
+        ('feature_extractor.rgb', lambda: fe.rgb(img)),
+        ('feature_extractor.quantize', lambda: fe.quantize(hog_i)),
+        ('feature_extractor.dequantize', lambda: fe.dequantize(quantized)),
+        ('feature_extractor.Projection.transform', lambda: proj.transform(hog_i)),
+        ('template_matching.extract', lambda: tm.extract(img, hog_op)),
+        ('template_matching.match_template', lambda: tm.match_template(hog_t, hog_i, hog_op)),
+        ('template_matching.match_template_opencv',
+         lambda: tm.match_template_opencv(template, img, tm._DEF_TM_OPT)),
+        ('template_matching.feature_match', lambda: tm.feature_match(template, img)),
+        ('template_matching.multi_feat_match', lambda: tm.multi_feat_match(template, img, multi_op)),
+        ('template_matching.match_one', lambda: tm.match_one(template, img, hog_op)),
+        ('template_matching.match_rotated', lambda: tm.match_rotated(template, img, hog_op)),
+        ('template_matching.match_video', lambda: list(tm.match_video(template, video))),
+    ]
+
+
+class RssSampler(object):
+    """
+    Samples the resident set size of the process on a background thread.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss():
+        """ :return: RSS in bytes or None if not available """
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (IOError, OSError):
+            return None
+
+    def __enter__(self):
+        self.start = self.peak = self.rss()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak = max(self.peak, self.rss())
+
+    @property
+    def growth(self):
+        return None if self.start is None else self.peak - self.start
+
+
+def _nbytes(result):
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, tuple):
+        return sum(_nbytes(r) for r in result)
+    return getattr(result, 'nbytes', 0)
+
+
+def measure(fn):
+    """
+    :return: (tracemalloc peak, RSS growth or None, output bytes) of a call
+    """
+    # warm-up, so that lazy imports and caches are not counted
+    fn()
+    gc.collect()
+
+    tracemalloc.start()
+    with RssSampler() as rss:
+        result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, rss.growth, _nbytes(result)
+
+
+def run(sizes=SIZES, only=None):
+    """
+    :param sizes: Input sizes (side of the square search image)
+    :param only: Substring of the case names to run
+    :return: Dict of 'name@size' -> dict(peak, rss, output) or dict(error) if the case raised
+    """
+    results = dict()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for side in sizes:
+            for name, fn in cases(side, tmp_dir):
+                if only is not None and only not in name:
+                    continue
+                key = '{}@{}'.format(name, side)
+                try:
+                    peak, rss, output = measure(fn)
+                except Exception as e:
+                    results[key] = dict(error='{}: {}'.format(type(e).__name__, e))
+                    continue
+                results[key] = dict(peak=peak, rss=rss, output=output)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def _selected(key, sizes, only):
+    name, side = key.rsplit('@', 1)
+    return int(side) in sizes and (only is None or only in name)
+
+
+def compare(results, baseline, tolerance, sizes=SIZES, only=None):
+    """
+    :return: Dict of the regressed cases -> reason. Cases whose tracemalloc peak grew beyond
+        the tolerance, cases that raised and cases of the baseline that were not measured.
+    """
+    regressions = dict()
+    for key, res in sorted(results.items()):
+        if 'error' in res:
+            regressions[key] = 'failed: {}'.format(res['error'])
+        elif key in baseline and res['peak'] > baseline[key]['peak'] * (1 + tolerance):
+            regressions[key] = 'peak {} MB > baseline {} MB + {:.0%}'.format(
+                _mb(res['peak']), _mb(baseline[key]['peak']), tolerance)
+
+    for key in sorted(baseline):
+        if key not in results and _selected(key, sizes, only):
+            regressions[key] = 'not measured'
+    return regressions
+
+
+def _mb(n):
+    return '-' if n is None else '{:.2f}'.format(n / 2 ** 20)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='Save the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed growth of the peak over the baseline (fraction)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--only', help='Run only the cases containing this string')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.only)
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print('{:45s} {:>10s} {:>10s} {:>10s} {:>8s} {:>10s}'.format(
+        'case', 'peak MB', 'rss MB', 'output MB', 'x output', 'baseline'))
+    for key, res in sorted(results.items()):
+        if 'error' in res:
+            print('{:45s} failed: {}'.format(key, res['error']))
+            continue
+        # in-place functions have no output
+        ratio = '{:.1f}'.format(res['peak'] / res['output']) if res['output'] else '-'
+        base = baseline.get(key, dict()).get('peak')
+        print('{:45s} {:>10s} {:>10s} {:>10s} {:>8s} {:>10s}'.format(
+            key, _mb(res['peak']), _mb(res['rss']), _mb(res['output']), ratio, _mb(base)))
+
+    if args.save:
+        failed = [key for key, res in results.items() if 'error' in res]
+        if failed:
+            print('not saved, failed cases: {}'.format(', '.join(sorted(failed))), file=sys.stderr)
+            return 1
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('saved {}'.format(args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.sizes, args.only)
+    for key, reason in sorted(regressions.items()):
+        print('REGRESSION {}: {}'.format(key, reason))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Memory and accuracy of quantized feature maps.
+
+    python benchmarks/bench_quantize.py
+"""
+from __future__ import division, print_function
+
+import time
+
+import cv2 as cv
+import numpy as np
+
+from cv_utils import template_matching as tm
+
+TEMPLATE = 'tests/resources/kelloggs-red-fruit.jpg'
+IMAGE = 'tests/resources/sch-image.jpg'
+
+
+def main():
+    template = cv.imread(TEMPLATE)
+    image = cv.imread(IMAGE)
+
+    op = dict(feature='hog', retain_size=False)
+    ref_t, ref_i = tm.extract(template, op), tm.extract(image, op)
+    ref = tm.match_template(ref_t, ref_i, op)
+
+    print('{:8s} {:>10s} {:>10s} {:>12s} {:>8s}'.format('', 'bytes', 'match s', 'max abs err', 'argmin'))
+    for quantize in [None, 'float16', 'uint8']:
+        qop = dict(op, quantize=quantize)
+        tmpl_f, img_f = tm.extract(template, qop), tm.extract(image, qop)
+
+        # first call of a new input kind runs the autotuner
+        tm.match_template(tmpl_f, img_f, qop)
+        start = time.time()
+        hmap = tm.match_template(tmpl_f, img_f, qop)
+        elapsed = time.time() - start
+
+        same = np.unravel_index(hmap.argmin(), hmap.shape) == np.unravel_index(ref.argmin(), ref.shape)
+        print('{:8s} {:10d} {:10.4f} {:12.5f} {:>8s}'.format(
+            str(quantize), tmpl_f.nbytes + img_f.nbytes, elapsed,
+            np.abs(hmap - ref).max(), 'same' if same else 'moved'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 from .bbox import Box, ViewBox, Label
 from .deepnet import DeepNet
-from . import template_matching, img_utils, feature_extractor, utils
+from . import template_matching, matching_backends, async_matching, img_utils, feature_extractor, synthetic, \
+    shared_features, evaluation, box_store, utils
 from .constants import *
 
 __all__ = [
@@ -17,7 +18,13 @@ __all__ = [
     Label,
     DeepNet,
     'template_matching',
+    'matching_backends',
+    'async_matching',
     'img_utils',
     'feature_extractor',
+    'synthetic',
+    'shared_features',
+    'evaluation',
+    'box_store',
     'utils'
 ]
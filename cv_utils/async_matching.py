@@ -0,0 +1,117 @@
+"""
+asyncio API for template matching.
+
+The feature extraction and the matching of each feature run on an executor, so the event loop
+is never blocked. OpenCV releases the GIL, so a thread pool can use all the cores.
+
+    matcher = AsyncMatcher(concurrency=8, timeout=2.0)
+    box, score = await matcher.match_one(template, image, dict(feature='hog'))
+"""
+from __future__ import division
+
+import asyncio
+import functools
+import multiprocessing
+import weakref
+
+from cv_utils import template_matching as tm, feature_extractor as fe
+
+
+class AsyncMatcher(object):
+    """
+    Runs template matching requests concurrently on an executor
+        with a limit on the number of concurrent requests and a deadline per request.
+
+    A cancelled or timed out request stops before its next stage (feature extraction or
+    matching of a feature). The stage already running on the executor is not interrupted.
+    """
+
+    def __init__(self, executor=None, concurrency=None, timeout=None):
+        """
+        :param executor: concurrent.futures executor. Default executor of the loop if None.
+        :param concurrency: Maximum number of requests processed at once. Default: CPU count
+        :param timeout: Default deadline of a request in seconds, including the time waiting
+            for its turn. No deadline if None.
+        """
+        self.executor = executor
+        self.concurrency = concurrency or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def match_one(self, template, image, options=None, timeout=None):
+        """
+        Same as template_matching.match_one
+
+        :param timeout: Deadline of this request in seconds. Default is the matcher's timeout.
+        :return: (Box, Score)
+        :raises asyncio.TimeoutError: if the deadline is exceeded
+        """
+        heatmap, scale = await self.multi_feat_match(template, image, options, timeout)
+
+        h, w = template.shape[:2]
+        return tm._best_match(heatmap, scale, w, h)
+
+    async def multi_feat_match(self, template, image, options=None, timeout=None):
+        """
+        Same as template_matching.multi_feat_match
+
+        :param timeout: Deadline of this request in seconds. Default is the matcher's timeout.
+        :return: (Heatmap, Scale)
+        :raises asyncio.TimeoutError: if the deadline is exceeded
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return await asyncio.wait_for(self._limited(template, image, options), timeout)
+
+    async def _limited(self, template, image, options):
+        # one semaphore per event loop, asyncio primitives can not be shared between loops
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphores[loop]:
+            return await self._match(template, image, options)
+
+    async def _match(self, template, image, options):
+        multi = options is not None and 'features' in options
+
+        heatmaps, img_feats = [], []
+        with fe.FeatureContext(template) as tmpl_ctx, fe.FeatureContext(image) as img_ctx:
+            for op in tm._feature_options(options):
+                tmpl_f, img_f = await self._run(_extract, tmpl_ctx, img_ctx, op)
+                heatmaps.append(await self._run(tm.match_template, tmpl_f, img_f, op))
+                img_feats.append(img_f)
+
+        return tm._merge_heatmaps(heatmaps, img_feats, multi, image.shape)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+
+def _extract(tmpl_ctx, img_ctx, op):
+    return tm.extract(tmpl_ctx, op), tm.extract(img_ctx, op)
+
+
+_matcher = None
+
+
+def _default_matcher():
+    global _matcher
+    if _matcher is None:
+        _matcher = AsyncMatcher()
+    return _matcher
+
+
+async def match_one(template, image, options=None, timeout=None):
+    """
+    template_matching.match_one on the default AsyncMatcher. (default executor of the loop)
+    """
+    return await _default_matcher().match_one(template, image, options, timeout)
+
+
+async def multi_feat_match(template, image, options=None, timeout=None):
+    """
+    template_matching.multi_feat_match on the default AsyncMatcher. (default executor of the loop)
+    """
+    return await _default_matcher().multi_feat_match(template, image, options, timeout)
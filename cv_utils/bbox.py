@@ -1,6 +1,9 @@
 from __future__ import division
 
+import bisect
+import heapq
 import math
+import operator
 
 from cv_utils.constants import *
 
@@ -10,14 +13,28 @@ class Box(object):
         To represent a bounding box.
 
         (x,y), width, and height
+
+        Boxes are light-weight immutable value objects. They use __slots__ instead of an
+        instance dict, compare and hash by their co-ordinates, and all the methods return
+        new boxes instead of modifying the current one. The co-ordinates are read-only
+        properties, assigning one raises AttributeError, so boxes are safe as set members
+        and dict keys.
     """
 
+    __slots__ = ('_x', '_y', '_width', '_height')
+
     # primary constructor
     def __init__(self, x, y, w, h):
-        self.x = x
-        self.y = y
-        self.width = w
-        self.height = h
+        self._x = x
+        self._y = y
+        self._width = w
+        self._height = h
+
+    # read-only co-ordinates
+    x = property(operator.attrgetter('_x'))
+    y = property(operator.attrgetter('_y'))
+    width = property(operator.attrgetter('_width'))
+    height = property(operator.attrgetter('_height'))
 
     # Other constructors
     @classmethod
@@ -44,28 +61,92 @@ class Box(object):
         return Box.from_xy(x, y, x2, y2)
 
     @staticmethod
-    def left_most(boxes):
+    def left_most(boxes, k=None):
         """
         Finds the left most box out of the given boxes.
 
         :param boxes: Array of Box objects
-        :return: The left-most Box object
+        :param k: If given, the k left-most boxes are returned instead
+        :return: The left-most Box object or a list of k left-most boxes ordered from left
         """
-        x_list = [(box.x, box) for box in boxes]
-        x_list.sort()
-        return x_list[0][1]
+        if k is None:
+            return min(boxes, key=_box_x)
+        return heapq.nsmallest(k, boxes, key=_box_x)
 
     @staticmethod
-    def right_most(boxes):
+    def right_most(boxes, k=None):
         """
         Finds the right most box out of the given boxes.
 
         :param boxes: Array of Box objects
-        :return: The right-most Box object
+        :param k: If given, the k right-most boxes are returned instead
+        :return: The right-most Box object or a list of k right-most boxes ordered from right
+        """
+        if k is None:
+            return max(boxes, key=_box_x)
+        return heapq.nlargest(k, boxes, key=_box_x)
+
+    @staticmethod
+    def cluster_boxes(boxes, th=0.0001):
+        """
+        Groups the boxes that overlap each other (directly or through other boxes)
+            and finds the enclosing box of each group.
+            Two boxes overlap when the intersection area is at least th times the area of the
+            smaller box, same as Box.overlaps. Boxes that only touch never overlap.
+
+        Uses a sweep line along x and union-find. The boxes crossing the sweep line are kept
+        sorted by y, so only the boxes whose x-ranges intersect and that start within the
+        largest box height above are compared, instead of all the pairs.
+
+        :param boxes: Array of Box objects
+        :param th: Overlap threshold
+        :return: Array of enclosing boxes, one per cluster, ordered by the left-most box
         """
-        x_list = [(box.x, box) for box in boxes]
-        x_list.sort()
-        return x_list[-1][1]
+        n = len(boxes)
+        parent = list(range(n))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        order = sorted(range(n), key=lambda i: boxes[i].x)
+        max_height = max(box.height for box in boxes) if n > 0 else 0
+
+        # heap of (x2, index) of the boxes crossing the sweep line
+        active = []
+        # the same boxes as (y, index) sorted by y, to visit only the boxes overlapping in y
+        active_y = []
+        for i in order:
+            box = boxes[i]
+            while active and active[0][0] <= box.x:
+                _, j = heapq.heappop(active)
+                del active_y[bisect.bisect_left(active_y, (boxes[j].y, j))]
+
+            # boxes starting more than max_height above can not reach this box
+            y2 = box.y + box.height
+            lo = bisect.bisect_right(active_y, (box.y - max_height, n))
+            hi = bisect.bisect_left(active_y, (y2, -1))
+            for _, j in active_y[lo:hi]:
+                other = boxes[j]
+                if other.y + other.height <= box.y:
+                    continue
+                small_area = min(box.area(), other.area())
+                int_area = Box.intersection_box(box, other).area()
+                if small_area > 0 and int_area / small_area >= th:
+                    ri, rj = find(i), find(j)
+                    if ri != rj:
+                        parent[max(ri, rj)] = min(ri, rj)
+
+            heapq.heappush(active, (box.x + box.width, i))
+            bisect.insort(active_y, (box.y, i))
+
+        clusters = dict()
+        for i in order:
+            clusters.setdefault(find(i), []).append(boxes[i])
+        return [Box.enclosing_box(cluster) for cluster in
+                sorted(clusters.values(), key=lambda c: c[0].x)]
 
     @staticmethod
     def intersection_box(box1, box2):
@@ -108,7 +189,7 @@ class Box(object):
         """
         Area of the current box object. A = width * height
         """
-        return self.width * self.height
+        return self._width * self._height
 
     def smaller(self, box):
         """
@@ -137,14 +218,14 @@ class Box(object):
         :param percentage: Percentage to expand
         :return: New expanded Box
         """
-        ex_h = math.ceil(self.height * percentage / 100)
-        ex_w = math.ceil(self.width * percentage / 100)
+        ex_h = math.ceil(self._height * percentage / 100)
+        ex_w = math.ceil(self._width * percentage / 100)
 
-        x = max(0, self.x - ex_w)
-        y = max(0, self.y - ex_h)
-        x2 = self.x + self.width + ex_w
-        y2 = self.y + self.height + ex_h
-        return Box.from_xy(x, y, x2, y2)
+        x = max(0, self._x - ex_w)
+        y = max(0, self._y - ex_h)
+        x2 = self._x + self._width + ex_w
+        y2 = self._y + self._height + ex_h
+        return Box(x, y, x2 - x, y2 - y)
 
     def padding(self, px):
         """
@@ -155,14 +236,16 @@ class Box(object):
         :return: New padding added box
         """
         # if px is not an array, have equal padding all sides
-        if not isinstance(px, list):
-            px = [px] * 4
+        if isinstance(px, list):
+            top, right, bottom, left = px
+        else:
+            top = right = bottom = left = px
 
-        x = max(0, self.x - px[3])
-        y = max(0, self.y - px[0])
-        x2 = self.x + self.width + px[1]
-        y2 = self.y + self.height + px[2]
-        return Box.from_xy(x, y, x2, y2)
+        x = max(0, self._x - left)
+        y = max(0, self._y - top)
+        x2 = self._x + self._width + right
+        y2 = self._y + self._height + bottom
+        return Box(x, y, x2 - x, y2 - y)
 
     def split(self, box_size):
         """
@@ -173,13 +256,13 @@ class Box(object):
         :return: Array of tiny boxes
         """
         w, h = box_size
-        rows = round(self.height / h)
-        cols = round(self.width / w)
+        rows = round(self._height / h)
+        cols = round(self._width / w)
 
         boxes = []
         for row in range(rows):
             for col in range(cols):
-                box = Box(self.x + (col * w), self.y + (row * h), w, h)
+                box = Box(self._x + (col * w), self._y + (row * h), w, h)
                 boxes.append(box)
         return boxes
 
@@ -191,8 +274,8 @@ class Box(object):
         :param y_percent: how much percentage from top edge
         :return: A point inside the box
         """
-        x = round(x_percent * self.width)
-        y = round(y_percent * self.height)
+        x = round(x_percent * self._width)
+        y = round(y_percent * self._height)
         return int(x), int(y)
 
     def move(self, point, reverse=False):
@@ -203,38 +286,76 @@ class Box(object):
         :param reverse: If true, the translation direction is reversed. ie. (-tx, -ty)
         :return: New translated box
         """
+        tx, ty = point
         if reverse:
-            point = [-1 * i for i in point]
-        return Box(self.x + point[0], self.y + point[1], self.width, self.height)
+            return Box(self._x - tx, self._y - ty, self._width, self._height)
+        return Box(self._x + tx, self._y + ty, self._width, self._height)
 
     def xy_coord(self):
-        return self.x, self.y, self.x + self.width, self.y + self.height
+        return self._x, self._y, self._x + self._width, self._y + self._height
 
     def top_left(self):
-        return self.x, self.y
+        return self._x, self._y
 
     def bottom_right(self):
-        return self.x + self.width, self.y + self.height
+        return self._x + self._width, self._y + self._height
 
     def top_right(self):
-        return self.x + self.width, self.y
+        return self._x + self._width, self._y
 
     def bottom_left(self):
-        return self.x, self.y + self.height
+        return self._x, self._y + self._height
 
     def to_int(self):
         """
         Rounds off and converts (x,y,w,h) to int
         :return: a Box object with all integer values
         """
-        coord = [int(round(x)) for x in self.xy_coord()]
-        return self.from_xy(coord[0], coord[1], coord[2], coord[3])
+        x, y = int(round(self._x)), int(round(self._y))
+        x2 = int(round(self._x + self._width))
+        y2 = int(round(self._y + self._height))
+        return Box(x, y, x2 - x, y2 - y)
+
+    def to_tup(self):
+        return self._x, self._y, self._width, self._height
+
+    def __eq__(self, other):
+        if not isinstance(other, Box):
+            return NotImplemented
+        return (self._x == other._x and self._y == other._y and
+                self._width == other._width and self._height == other._height)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash((self._x, self._y, self._width, self._height))
+
+    def __getstate__(self):
+        return self.to_tup()
+
+    def __setstate__(self, state):
+        Box.__init__(self, *state)
 
     def __str__(self):
         return '(x: {0.x}, y: {0.y}, w: {0.width}, h: {0.height})'.format(self)
 
+    def __repr__(self):
+        return '{0}({1.x!r}, {1.y!r}, {1.width!r}, {1.height!r})'.format(
+            type(self).__name__, self)
+
+
+def _box_x(box):
+    return box.x
+
 
 class ViewBox(Box):
+    """
+    Box with its display attributes. (color, labels and line thickness)
+    """
+
+    __slots__ = ('color', 'labels', 'thickness')
 
     def __init__(self, box, color=None, labels=None, thickness=1):
         super(ViewBox, self).__init__(box.x, box.y, box.width, box.height)
@@ -244,13 +365,59 @@ class ViewBox(Box):
         self.labels = labels
         self.thickness = thickness
 
+    def __getstate__(self):
+        return self.to_tup(), self.color, self.labels, self.thickness
+
+    def __setstate__(self, state):
+        Box.__setstate__(self, state[0])
+        self.color, self.labels, self.thickness = state[1:]
+
+    def __repr__(self):
+        return ('ViewBox(Box({0.x!r}, {0.y!r}, {0.width!r}, {0.height!r}), color={0.color!r}, '
+                'labels={0.labels!r}, thickness={0.thickness!r})'.format(self))
+
+
+class Label(object):
+    """
+    Text label displayed relative to a ViewBox.
+        Immutable like Box, the fields are read-only properties.
+    """
 
-class Label:
+    __slots__ = ('_pos', '_text', '_angle', '_color')
 
     def __init__(self, pos, text, angle=0, color=None):
         if color is None:
             color = COL_WHITE
-        self.pos = pos
-        self.text = text
-        self.angle = angle
-        self.color = color
+        self._pos = pos
+        self._text = text
+        self._angle = angle
+        self._color = color
+
+    pos = property(operator.attrgetter('_pos'))
+    text = property(operator.attrgetter('_text'))
+    angle = property(operator.attrgetter('_angle'))
+    color = property(operator.attrgetter('_color'))
+
+    def _key(self):
+        return tuple(self.pos), self.text, self.angle, tuple(self.color)
+
+    def __eq__(self, other):
+        if not isinstance(other, Label):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return self.pos, self.text, self.angle, self.color
+
+    def __setstate__(self, state):
+        self._pos, self._text, self._angle, self._color = state
+
+    def __repr__(self):
+        return 'Label({0.pos!r}, {0.text!r}, angle={0.angle!r}, color={0.color!r})'.format(self)
@@ -0,0 +1,172 @@
+"""
+Columnar binary storage of large sets of Box, ViewBox and Label objects.
+
+A store is a directory of .npy columns: coordinates, colors and thickness of the boxes and the
+labels of all the boxes, with their texts as one utf-8 buffer indexed by offsets. The columns
+are memory-mapped on load, so opening a store is instant whatever its size. Objects are only
+created for the boxes accessed.
+
+    box_store.save('annotations', view_boxes)
+    store = box_store.load('annotations')
+    iou = evaluation.iou_matrix(store.boxes, gt_boxes)
+    vbox = store[42]
+"""
+from __future__ import division
+
+import json
+import numbers
+import os
+
+import numpy as np
+
+from cv_utils import Box, ViewBox, Label
+
+VERSION = 1
+
+# missing color, eg: ViewBox(box, color=None)
+_NO_COLOR = -1
+
+
+def _colors(colors):
+    """ N x 3 int16 array of colors, None as _NO_COLOR """
+    arr = np.full((len(colors), 3), _NO_COLOR, dtype=np.int16)
+    for i, color in enumerate(colors):
+        if color is not None:
+            arr[i, :len(color)] = color
+    return arr
+
+
+def _color(row):
+    return None if row[0] == _NO_COLOR else [int(c) for c in row]
+
+
+def _coords(rows, width):
+    """
+    N x width coordinate array, int64 if all the values are integers and float64 otherwise,
+        and N bools whether each row is integer, to restore the types of the values.
+    """
+    is_int = np.array([all(isinstance(v, numbers.Integral) for v in row) for row in rows],
+                      dtype=bool)
+    dtype = np.int64 if is_int.all() else np.float64
+    return np.array(rows, dtype=dtype).reshape(-1, width), is_int
+
+
+def _values(arr, is_int):
+    """ Row of a coordinate column as python ints or floats """
+    return [int(v) for v in arr] if is_int else [float(v) for v in arr]
+
+
+def save(path, boxes):
+    """
+    Saves boxes to a store directory. Existing columns in the directory are overwritten.
+        Integer coordinates are stored and loaded back as integers.
+
+    :param path: Directory of the store
+    :param boxes: List of Box or ViewBox objects
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # readers must not open a mix of old and new columns while they are rewritten
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    n = len(boxes)
+    view = np.array([isinstance(box, ViewBox) for box in boxes], dtype=bool)
+    vboxes = [box if view[i] else None for i, box in enumerate(boxes)]
+
+    labels, label_counts = [], np.zeros(n, dtype=np.int64)
+    for i, vbox in enumerate(vboxes):
+        if vbox is not None:
+            labels.extend(vbox.labels)
+            label_counts[i] = len(vbox.labels)
+
+    texts = [label.text.encode('utf-8') for label in labels]
+    coords, int_boxes = _coords([box.to_tup() for box in boxes], 4)
+    label_pos, int_pos = _coords([tuple(label.pos) for label in labels], 2)
+
+    columns = dict(
+        boxes=coords,
+        int_boxes=int_boxes,
+        view=view,
+        color=_colors([vbox.color if vbox is not None else None for vbox in vboxes]),
+        thickness=np.array([vbox.thickness if vbox is not None else 1 for vbox in vboxes],
+                           dtype=np.int32),
+        label_offsets=np.concatenate(([0], np.cumsum(label_counts))),
+        label_pos=label_pos,
+        int_label_pos=int_pos,
+        label_angle=np.array([label.angle for label in labels], dtype=np.float64),
+        label_color=_colors([label.color for label in labels]),
+        text_offsets=np.concatenate(([0], np.cumsum([len(t) for t in texts], dtype=np.int64))),
+        text=np.frombuffer(b''.join(texts), dtype=np.uint8),
+    )
+    for name, arr in columns.items():
+        np.save(os.path.join(path, name + '.npy'), arr)
+
+    # written last, a store without it is incomplete
+    with open(meta_path, 'w') as f:
+        json.dump(dict(version=VERSION, count=n, labels=len(labels)), f)
+
+
+def load(path, mmap=True):
+    """
+    :param path: Directory of the store
+    :param mmap: Memory-map the columns instead of reading them
+    :return: BoxStore
+    """
+    return BoxStore(path, mmap)
+
+
+class BoxStore(object):
+    """
+    Read-only sequence of the boxes of a store. Box or ViewBox objects are created on access.
+        Column arrays (eg: boxes) can be used directly for vectorized processing.
+    """
+
+    def __init__(self, path, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] > VERSION:
+            raise ValueError('Unsupported box store version: {}'.format(meta['version']))
+
+        mmap_mode = 'r' if mmap else None
+        for name in ('boxes', 'int_boxes', 'view', 'color', 'thickness', 'label_offsets',
+                     'label_pos', 'int_label_pos', 'label_angle', 'label_color',
+                     'text_offsets', 'text'):
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, i):
+        """
+        :param i: Index or slice
+        :return: Box or ViewBox, list of them for a slice
+        """
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('box index out of range')
+
+        box = Box(*_values(self.boxes[i], self.int_boxes[i]))
+        if not self.view[i]:
+            return box
+        return ViewBox(box, _color(self.color[i]), self.labels(i), int(self.thickness[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def labels(self, i):
+        """
+        :return: List of the Label objects of the i-th box
+        """
+        labels = []
+        for j in range(self.label_offsets[i], self.label_offsets[i + 1]):
+            text = self.text[self.text_offsets[j]:self.text_offsets[j + 1]].tobytes().decode('utf-8')
+            labels.append(Label(tuple(_values(self.label_pos[j], self.int_label_pos[j])), text,
+                                float(self.label_angle[j]), _color(self.label_color[j])))
+        return labels
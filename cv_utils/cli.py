@@ -0,0 +1,192 @@
+"""
+Command line interface of cv_utils.
+
+    cv-utils match -t templates/ -o results.jsonl 'images/*.jpg'
+
+Matches every template against every search image on a process pool and streams the results
+as JSON lines (one line per image and template) in the order they complete.
+"""
+from __future__ import division, print_function
+
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2 as cv
+
+from cv_utils import utils, template_matching as tm
+
+
+# templates loaded once per worker process, see _init_worker
+_templates = None
+
+
+def list_images(paths):
+    """
+    Expands the given paths into a sorted list of image files.
+
+    :param paths: List of image files, directories or glob patterns
+    :return: List of image file paths
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, fname) for fname in utils.each_img(path))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def match_options(args):
+    """
+    Builds template matching options from the parsed command line arguments.
+    """
+    op = dict(distance=args.distance, normalize=args.normalize)
+    if len(args.feature) > 1:
+        op['features'] = [dict(op, feature=feature) for feature in args.feature]
+    else:
+        op['feature'] = args.feature[0]
+    return op
+
+
+def completed(out_path):
+    """
+    Reads an existing result file and finds the (file, template) pairs that are already done.
+
+    :param out_path: JSONL result file
+    :return: Set of (file, template) tuples
+    """
+    done = set()
+    if out_path is None or not os.path.exists(out_path):
+        return done
+
+    with open(out_path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # partially written last line of an interrupted run
+                continue
+            done.add((rec['file'], rec['template']))
+    return done
+
+
+def _init_worker(template_paths):
+    global _templates
+    _templates = [(path, cv.imread(path)) for path in template_paths]
+
+
+def _match_file(fname, options, skip):
+    start = time.time()
+    image = cv.imread(fname)
+    load_time = time.time() - start
+
+    records = []
+    for tmpl_path, template in _templates:
+        if tmpl_path in skip:
+            continue
+
+        rec = dict(file=fname, template=tmpl_path)
+        if image is None or template is None:
+            rec['error'] = 'unable to read image'
+            records.append(rec)
+            continue
+
+        start = time.time()
+        try:
+            box, score = tm.match_one(template, image, options)
+        except Exception as e:
+            # eg: template larger than the image, the other pairs of the batch go on
+            rec['error'] = '{}: {}'.format(type(e).__name__, e)
+            records.append(rec)
+            continue
+
+        rec['box'] = [box.x, box.y, box.width, box.height]
+        # NaN is not valid JSON. eg: constant heatmap of a template matched against itself
+        rec['score'] = float(score) if math.isfinite(score) else None
+        rec['timings'] = dict(load=load_time, match=time.time() - start)
+        records.append(rec)
+    return records
+
+
+def match(args):
+    templates = list_images(args.template)
+    if not templates:
+        print('No templates found', file=sys.stderr)
+        return 1
+
+    done = completed(args.output) if args.resume else set()
+
+    jobs = []
+    for fname in list_images(args.images):
+        skip = set(tmpl for tmpl in templates if (fname, tmpl) in done)
+        if len(skip) < len(templates):
+            jobs.append((fname, skip))
+
+    options = match_options(args)
+    out = sys.stdout
+    if args.output is not None:
+        out = open(args.output, 'a' if args.resume else 'w')
+        # terminate a partially written line of the interrupted run
+        if args.resume and out.tell() > 0:
+            with open(args.output, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    out.write('\n')
+
+    try:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                 initargs=(templates,)) as pool:
+            futures = [pool.submit(_match_file, fname, options, skip) for fname, skip in jobs]
+            for future in as_completed(futures):
+                for rec in future.result():
+                    out.write(json.dumps(rec, allow_nan=False) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='cv-utils', description='Computer vision utilities')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    mp = commands.add_parser('match', help='Batch template matching. Results are written as JSONL.')
+    mp.add_argument('images', nargs='+', help='Search image files, directories or glob patterns')
+    mp.add_argument('-t', '--template', action='append', required=True,
+                    help='Template image file, directory or glob pattern. Can be repeated.')
+    mp.add_argument('-f', '--feature', action='append',
+                    help="Feature to match with (default: rgb). "
+                         "Repeat to combine multiple features.")
+    mp.add_argument('-d', '--distance', default='correlation',
+                    choices=['correlation', 'euclidean', 'ccoeff'])
+    mp.add_argument('--no-normalize', dest='normalize', action='store_false',
+                    help='Do not normalize the heatmap')
+    mp.add_argument('-o', '--output', help='JSONL output file (default: stdout)')
+    mp.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(),
+                    help='Number of worker processes (default: number of CPUs)')
+    mp.add_argument('--resume', action='store_true',
+                    help='Skip the (image, template) pairs already present in the output file')
+    mp.set_defaults(func=match)
+
+    args = parser.parse_args(argv)
+    if args.command == 'match' and args.feature is None:
+        args.feature = ['rgb']
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
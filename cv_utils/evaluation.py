@@ -0,0 +1,229 @@
+"""
+Evaluation of detections (predicted boxes with scores) against ground truth boxes.
+
+IoU is computed for all the pairs of an image at once. The results of each image are
+accumulated in fixed score bins, so any number of images can be streamed through an Evaluator
+with constant memory.
+
+    ev = Evaluator()
+    for pred_boxes, scores, gt_boxes in results:
+        ev.add(pred_boxes, scores, gt_boxes)
+    print(ev.mean_average_precision())
+"""
+from __future__ import division
+
+import numpy as np
+import scipy.optimize
+
+from cv_utils import Box
+
+
+# IoU thresholds 0.5:0.05:0.95
+DEF_IOU_THRESHOLDS = tuple(np.round(np.arange(0.5, 0.96, 0.05), 2))
+
+
+def boxes_array(boxes):
+    """
+    :param boxes: List of Box objects or N x 4 array of (x, y, width, height)
+    :return: N x 4 float array of (x, y, width, height)
+    """
+    if len(boxes) > 0 and isinstance(boxes[0], Box):
+        return np.array([box.to_tup() for box in boxes], dtype=np.float64)
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def iou_matrix(boxes1, boxes2):
+    """
+    Intersection over union of every pair of boxes. Same as Box.iou for each pair.
+
+    :param boxes1: N boxes. List of Box objects or N x 4 array
+    :param boxes2: M boxes. List of Box objects or M x 4 array
+    :return: N x M array of IoU values
+    """
+    a = boxes_array(boxes1)
+    b = boxes_array(boxes2)
+
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+
+    iw = np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    ih = np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    iou = np.zeros_like(inter)
+    np.divide(inter, union, out=iou, where=union > 0)
+    return iou
+
+
+def assign(iou, scores, thresholds, method='greedy'):
+    """
+    Assigns each prediction to at most one ground truth box, for each IoU threshold.
+
+    :param iou: N x M IoU matrix of predictions and ground truth boxes
+    :param scores: N scores of the predictions, higher is better
+    :param thresholds: T IoU thresholds
+    :param method: 'greedy': predictions in decreasing score take the best free ground truth box,
+        'hungarian': maximum total IoU assignment
+    :return: T x N bool array, whether each prediction is a true positive
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    n, m = iou.shape
+    tp = np.zeros((len(thresholds), n), dtype=bool)
+    if n == 0 or m == 0:
+        return tp
+
+    if method == 'greedy':
+        matched = np.zeros((len(thresholds), m), dtype=bool)
+        t_idx = np.arange(len(thresholds))
+        for i in np.argsort(-np.asarray(scores), kind='mergesort'):
+            cand = (iou[i][None, :] >= thresholds[:, None]) & ~matched
+            best = np.where(cand, iou[i][None, :], -1).argmax(axis=1)
+            hit = cand[t_idx, best]
+            tp[hit, i] = True
+            matched[t_idx[hit], best[hit]] = True
+    elif method == 'hungarian':
+        for t, th in enumerate(thresholds):
+            cost = np.where(iou >= th, -iou, 0)
+            rows, cols = scipy.optimize.linear_sum_assignment(cost)
+            tp[t, rows[iou[rows, cols] >= th]] = True
+    else:
+        raise ValueError('Unknown assignment method: {}'.format(method))
+    return tp
+
+
+def average_precision(precision, recall):
+    """
+    Area under the precision-recall curve with all-point interpolation.
+
+    :param precision: Precision at decreasing score thresholds
+    :param recall: Recall at decreasing score thresholds (non-decreasing)
+    :return: Average precision
+    """
+    p = np.concatenate(([0.0], precision, [0.0]))
+    r = np.concatenate(([0.0], recall, [recall[-1] if len(recall) else 0.0]))
+    # precision envelope
+    p = np.maximum.accumulate(p[::-1])[::-1]
+    return float(np.sum((r[1:] - r[:-1]) * p[1:]))
+
+
+class Evaluator(object):
+    """
+    Accumulates the detections of many images and computes precision/recall curves and AP.
+        Predictions are counted in fixed bins of score, memory does not grow with the images.
+        Predictions in the same bin are treated as equal scores.
+    """
+
+    def __init__(self, iou_thresholds=DEF_IOU_THRESHOLDS, method='greedy',
+                 score_range=(0.0, 1.0), bins=1000, lower_is_better=False):
+        """
+        :param iou_thresholds: IoU thresholds to evaluate at
+        :param method: Assignment method, 'greedy' or 'hungarian'
+        :param score_range: (min, max) of the scores. Scores outside are clipped.
+        :param bins: Number of score bins. The resolution of the precision-recall curves.
+        :param lower_is_better: True for distance scores, like the template matching heatmaps
+        """
+        self.iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+        self.method = method
+        self.score_range = score_range
+        self.bins = bins
+        self.lower_is_better = lower_is_better
+
+        # per class: [tp counts (T x bins), fp counts (T x bins), number of ground truth boxes]
+        self._stats = dict()
+
+    def _class_stats(self, label):
+        if label not in self._stats:
+            shape = (len(self.iou_thresholds), self.bins)
+            self._stats[label] = [np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64), 0]
+        return self._stats[label]
+
+    def _bin(self, scores):
+        lo, hi = self.score_range
+        pos = (np.asarray(scores, dtype=np.float64) - lo) / (hi - lo)
+        if self.lower_is_better:
+            pos = 1 - pos
+        return np.clip((pos * self.bins).astype(np.int64), 0, self.bins - 1)
+
+    def add(self, pred_boxes, scores, gt_boxes, pred_labels=None, gt_labels=None):
+        """
+        Adds the detections of one image.
+
+        :param pred_boxes: Predicted boxes. List of Box objects or N x 4 array
+        :param scores: N scores of the predictions
+        :param gt_boxes: Ground truth boxes. List of Box objects or M x 4 array
+        :param pred_labels: N class labels of the predictions. Single class if None.
+        :param gt_labels: M class labels of the ground truth boxes. Single class if None.
+        """
+        pred = boxes_array(pred_boxes)
+        gt = boxes_array(gt_boxes)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        pred_labels = np.zeros(len(pred), dtype=int) if pred_labels is None else np.asarray(pred_labels)
+        gt_labels = np.zeros(len(gt), dtype=int) if gt_labels is None else np.asarray(gt_labels)
+
+        iou = iou_matrix(pred, gt)
+        # higher is better for the assignment
+        order_scores = -scores if self.lower_is_better else scores
+
+        for label in set(pred_labels.tolist()) | set(gt_labels.tolist()):
+            p_idx = np.flatnonzero(pred_labels == label)
+            g_idx = np.flatnonzero(gt_labels == label)
+
+            tp = assign(iou[np.ix_(p_idx, g_idx)], order_scores[p_idx], self.iou_thresholds,
+                        self.method)
+            bins = self._bin(scores[p_idx])
+
+            stats = self._class_stats(label)
+            for t in range(len(self.iou_thresholds)):
+                stats[0][t] += np.bincount(bins[tp[t]], minlength=self.bins)
+                stats[1][t] += np.bincount(bins[~tp[t]], minlength=self.bins)
+            stats[2] += len(g_idx)
+
+    def precision_recall(self, iou_threshold=0.5, label=0):
+        """
+        Precision-recall curve of a class at an IoU threshold.
+
+        :return: (precision, recall, scores) at decreasing score thresholds (bin edges)
+        """
+        t = int(np.argmin(np.abs(self.iou_thresholds - iou_threshold)))
+        tp_bins, fp_bins, n_gt = self._class_stats(label)
+
+        # from the best scores to the worst
+        tp = np.cumsum(tp_bins[t][::-1])
+        fp = np.cumsum(fp_bins[t][::-1])
+
+        precision = np.zeros(self.bins)
+        np.divide(tp, tp + fp, out=precision, where=(tp + fp) > 0)
+        recall = tp / n_gt if n_gt > 0 else np.zeros(self.bins)
+
+        lo, hi = self.score_range
+        edges = np.linspace(hi, lo, self.bins + 1)[1:]
+        if self.lower_is_better:
+            edges = np.linspace(lo, hi, self.bins + 1)[1:]
+        return precision, recall, edges
+
+    def average_precision(self, label=0):
+        """
+        :return: Dict of IoU threshold -> AP of the class
+        """
+        aps = dict()
+        for th in self.iou_thresholds:
+            precision, recall, _ = self.precision_recall(th, label)
+            aps[float(th)] = average_precision(precision, recall)
+        return aps
+
+    def mean_average_precision(self):
+        """
+        Mean of AP over the classes (with ground truth boxes) and IoU thresholds.
+
+        :return: (mAP, Dict of IoU threshold -> mAP over the classes)
+        """
+        labels = [label for label, stats in self._stats.items() if stats[2] > 0]
+        if not labels:
+            return 0.0, dict()
+
+        per_th = dict()
+        for label in labels:
+            for th, ap in self.average_precision(label).items():
+                per_th[th] = per_th.get(th, 0.0) + ap / len(labels)
+        return float(np.mean(list(per_th.values()))), per_th
@@ -1,3 +1,5 @@
+import hashlib
+
 import numpy as np
 import cv2 as cv
 
@@ -10,6 +12,258 @@ _DEF_HOG_OPTS = dict(cell_size=(8, 8), orientations=8, block_size=(1, 1))
 _deepnet = None
 
 
+class FeatureContext(object):
+    """
+    Per-image cache of intermediate representations shared by the feature extractors.
+        Gray-scale and color space conversions are computed at most once per image,
+        no matter how many features are extracted from it.
+
+    Can be used as a context manager, the cache is released on exit.
+    """
+
+    def __init__(self, img, features=None):
+        """
+        :param img: Input image
+        :param features: Already extracted features of the image, by feature key.
+            (see template_matching.feature_key) Not affected by release.
+        """
+        self.img = img
+        self.features = features if features is not None else dict()
+        self._cache = dict()
+
+    @classmethod
+    def of(cls, img):
+        """
+        Wraps the given image in a FeatureContext, unless it is one already.
+            Objects with a feature_context() method (eg: shared_features.SharedFeaturesHandle)
+            provide their own context.
+
+        :param img: Input image or FeatureContext
+        :return: FeatureContext
+        """
+        if isinstance(img, cls):
+            return img
+        if hasattr(img, 'feature_context'):
+            return img.feature_context()
+        return cls(img)
+
+    @property
+    def shape(self):
+        return self.img.shape
+
+    def _memo(self, key, fn):
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key]
+
+    def color(self, code):
+        """
+        Converts the image to another color space using cv.cvtColor
+
+        :param code: OpenCV color conversion code. eg: cv.COLOR_BGR2LAB
+        :return: Converted image
+        """
+        return self._memo(('color', code), lambda: cv.cvtColor(self.img, code))
+
+    def gray(self):
+        """
+        Gray-scale version of the image. Gray-scale input is returned as is.
+        """
+        if self.img.ndim == 2:
+            return self.img
+        return self.color(cv.COLOR_BGR2GRAY)
+
+    def release(self):
+        """
+        Drops all the cached representations.
+        """
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class QuantizedFeature(object):
+    """
+    Feature map stored as uint8 with a scale and an offset per channel.
+        feature ~= data * scale + offset
+
+    8 times smaller than float64 features. The tunable matching backends (opencv, numpy, fft)
+    dequantize it a few channels at a time, so the full float feature map is never allocated.
+    """
+
+    def __init__(self, data, scale, offset):
+        self.data = data
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.scale.nbytes + self.offset.nbytes
+
+    def dequantize(self, start=None, stop=None, dtype=np.float32):
+        """
+        Float feature map of the channels [start, stop)
+
+        :return: H x W x C float array
+        """
+        data = self.data[:, :, start:stop]
+        feat = data.astype(dtype)
+        feat *= self.scale[start:stop].astype(dtype)
+        feat += self.offset[start:stop].astype(dtype)
+        return feat
+
+
+def quantize(feat, dtype='uint8'):
+    """
+    Compact representation of a feature map to save memory.
+
+    :param feat: H x W x C feature map
+    :param dtype: 'uint8' to quantize each channel linearly between its min and max values
+        or 'float16' for half precision floats
+    :return: QuantizedFeature for 'uint8' or float16 array
+    """
+    if dtype == 'float16':
+        return feat.astype(np.float16)
+    if dtype != 'uint8':
+        raise ValueError('Unsupported quantization: {}'.format(dtype))
+
+    if feat.ndim == 2:
+        feat = feat[:, :, np.newaxis]
+    feat = feat.astype(np.float32)
+    offset = feat.min(axis=(0, 1))
+    scale = (feat.max(axis=(0, 1)) - offset) / 255
+    scale[scale == 0] = 1
+
+    data = feat - offset
+    data /= scale
+    data = np.rint(data, out=data).astype(np.uint8)
+    return QuantizedFeature(data, scale, offset)
+
+
+def dequantize(feat, dtype=np.float32):
+    """
+    Float feature map of a quantized (or float16) feature map. Other arrays are returned as is.
+    """
+    if isinstance(feat, QuantizedFeature):
+        return feat.dequantize(dtype=dtype)
+    if feat.dtype == np.float16:
+        return feat.astype(dtype)
+    return feat
+
+
+class Projection(object):
+    """
+    Linear projection of the feature channels to fewer channels. (PCA or random projection)
+        Matching cost grows with the number of channels, and features with max of 3 channels
+        can use the faster OpenCV matching.
+    """
+
+    def __init__(self, components, mean, variance_retained, method='pca'):
+        """
+        :param components: C x K projection matrix with orthonormal columns
+        :param mean: C channel means, subtracted before the projection
+        :param variance_retained: Fraction of the feature variance kept by the projection
+        :param method: 'pca' or 'random'
+        """
+        self.components = np.asarray(components, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.variance_retained = float(variance_retained)
+        self.method = method
+        self._digest = hashlib.sha1(self.components.tobytes() + self.mean.tobytes()).hexdigest()
+
+    @classmethod
+    def fit(cls, feats, n_components=3, method='pca', max_samples=100000, seed=0):
+        """
+        Learns a projection from a sample of feature maps.
+
+        :param feats: List of H x W x C feature maps
+        :param n_components: Number of output channels
+        :param method: 'pca' for principal components or 'random' for a random orthonormal basis
+        :param max_samples: Maximum number of feature vectors (pixels) used to fit
+        :param seed: Seed to sample the pixels and of the random projection
+        :return: Projection. Its variance_retained tells how much of the sample variance is kept.
+        """
+        rng = np.random.RandomState(seed)
+        pixels = [f.reshape(-1, f.shape[-1]) for f in feats]
+        offsets = np.cumsum([0] + [len(p) for p in pixels])
+
+        # sample the pixel indexes first, only the sampled rows are converted and concatenated
+        if offsets[-1] > max_samples:
+            index = np.sort(rng.choice(offsets[-1], max_samples, replace=False))
+            bounds = np.searchsorted(index, offsets)
+            pixels = [p[index[start:end] - offset] for p, offset, start, end in
+                      zip(pixels, offsets, bounds[:-1], bounds[1:])]
+        samples = np.concatenate(pixels).astype(np.float64)
+
+        mean = samples.mean(axis=0)
+        cov = np.cov(samples - mean, rowvar=False).reshape(samples.shape[1], samples.shape[1])
+
+        if method == 'pca':
+            _, vectors = np.linalg.eigh(cov)
+            components = vectors[:, ::-1][:, :n_components]
+        elif method == 'random':
+            components, _ = np.linalg.qr(rng.randn(samples.shape[1], n_components))
+        else:
+            raise ValueError('Unknown projection method: {}'.format(method))
+
+        total = np.trace(cov)
+        kept = np.trace(components.T.dot(cov).dot(components))
+        return cls(components, mean, kept / total if total > 0 else 1.0, method)
+
+    @property
+    def n_components(self):
+        return self.components.shape[1]
+
+    def transform(self, feat):
+        """
+        :param feat: H x W x C feature map
+        :return: H x W x K projected feature map (float32)
+        """
+        h, w, c = feat.shape
+        res = feat.reshape(-1, c).astype(np.float32) - self.mean
+        return res.dot(self.components).reshape(h, w, self.n_components)
+
+    def save(self, path):
+        np.savez(path, components=self.components, mean=self.mean,
+                 variance_retained=self.variance_retained, method=self.method)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['components'], data['mean'], data['variance_retained'], str(data['method']))
+
+    def __str__(self):
+        return 'Projection({}, {}->{}, {})'.format(self.method, self.components.shape[0],
+                                                   self.n_components, self._digest)
+
+
+_projections = dict()
+
+
+def projection(proj):
+    """
+    :param proj: Projection or path of a saved projection. Loaded projections are cached.
+    :return: Projection
+    """
+    if isinstance(proj, Projection):
+        return proj
+    if proj not in _projections:
+        _projections[proj] = Projection.load(proj)
+    return _projections[proj]
+
+
 def factory(feature):
     """
     Factory to choose feature extractor
@@ -36,6 +290,7 @@ def factory(feature):
 
 
 def deep(img, op=None):
+    img = FeatureContext.of(img).img
     if op is None or op['prototxt'] is None or op['caffemodel'] is None:
         raise Exception('Insufficient options. prototxt and caffemodel required')
 
@@ -45,14 +300,15 @@ def deep(img, op=None):
 
     img_f = _deepnet.extract_feature(img, op['layer'])
 
-    return img_f
+    # C x H x W from caffe to H x W x C like the other features
+    return img_f.transpose((1, 2, 0))
 
 
 def hog(img, options=None):
     """
     HOG feature extractor.
 
-    :param img:
+    :param img: Input image or FeatureContext
     :param options:
     :return: HOG Feature for given image
         The output will have channels same as number of orientations.
@@ -62,7 +318,7 @@ def hog(img, options=None):
     if options is not None:
         op.update(options)
 
-    img = gray(img)
+    img = FeatureContext.of(img).gray()
     img_fd = skimage.feature.hog(img,
                                  orientations=op['orientations'],
                                  pixels_per_cell=op['cell_size'],
@@ -83,24 +339,24 @@ def hog(img, options=None):
 
 
 def gray(img, op=None):
-    return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    return FeatureContext.of(img).gray()
 
 
 def lab(img, op=None):
-    return cv.cvtColor(img, cv.COLOR_BGR2LAB)
+    return FeatureContext.of(img).color(cv.COLOR_BGR2LAB)
 
 
 def luv(img, op=None):
-    return cv.cvtColor(img, cv.COLOR_BGR2Luv)
+    return FeatureContext.of(img).color(cv.COLOR_BGR2Luv)
 
 
 def hsv(img, op=None):
-    return cv.cvtColor(img, cv.COLOR_BGR2HSV)
+    return FeatureContext.of(img).color(cv.COLOR_BGR2HSV)
 
 
 def hls(img, op=None):
-    return cv.cvtColor(img, cv.COLOR_BGR2HLS)
+    return FeatureContext.of(img).color(cv.COLOR_BGR2HLS)
 
 
 def rgb(img, op=None):
-    return img
+    return FeatureContext.of(img).img
@@ -4,7 +4,9 @@ import cv2 as cv
 import math
 import os
 import numpy as np
+import queue
 import random
+import threading
 from scipy import ndimage
 from matplotlib import pyplot as plt
 
@@ -65,16 +67,103 @@ def add_bg(img, padding, color=COL_WHITE):
     Adds a padding to the given image as background of specified color
 
     :param img: Input image.
-    :param padding: constant padding around the image.
+    :param padding: constant padding around the image or [top right bottom left] padding.
     :param color: background color that needs to filled for the newly padded region.
-    :return: New image with background.
+    :return: New image with background. Gray-scale images get a channel axis.
     """
-    img = gray3(img)
-    h, w, d = img.shape
-    new_img = np.ones((h + 2*padding, w + 2*padding, d)) * color[:d]
-    new_img = new_img.astype(np.uint8)
-    set_img_box(new_img, (padding, padding, w, h), img)
-    return new_img
+    return pad(gray3(img), padding, color)
+
+
+def _paddings(padding):
+    """ (top, right, bottom, left) from a single value or [top right bottom left] like Box.padding """
+    if isinstance(padding, (list, tuple)):
+        return tuple(int(p) for p in padding)
+    return (int(padding),) * 4
+
+
+def _bg_value(color, img):
+    """
+    Background color with as many channels as the image, in the image dtype.
+        Missing channels are 0, like cv.copyMakeBorder. eg: alpha of a BGR color
+    """
+    if img.ndim == 2:
+        return np.array(color[0], dtype=img.dtype)
+    value = np.zeros(img.shape[2], dtype=img.dtype)
+    color = color[:img.shape[2]]
+    value[:len(color)] = color
+    return value
+
+
+def _fill_border(out, top, right, bottom, left, value):
+    """ Fills the padding of the (y, x) image axes of out, leaves the inside as is """
+    if value.ndim == 0:
+        # channel axis view of gray-scale images
+        out = out[..., np.newaxis]
+    h, w = out.shape[-3:-1]
+    out[..., :top, :, :] = value
+    out[..., h - bottom:, :, :] = value
+    out[..., top:h - bottom, :left, :] = value
+    out[..., top:h - bottom, w - right:, :] = value
+
+
+def pad(img, padding, color=COL_BLACK, out=None):
+    """
+    Pads the image with a constant color. The image dtype is kept, no float temporaries.
+
+    :param img: Input image. (H x W or H x W x C)
+    :param padding: constant padding around the image or [top right bottom left] padding.
+    :param color: Color of the padding
+    :param out: Output array to write to, of the padded image shape and dtype
+    :return: Padded image (out if given)
+    """
+    top, right, bottom, left = _paddings(padding)
+    h, w = img.shape[:2]
+    shape = (h + top + bottom, w + left + right) + img.shape[2:]
+
+    if out is None and (img.ndim == 2 or img.shape[2] <= 4):
+        res = cv.copyMakeBorder(img, top, bottom, left, right, cv.BORDER_CONSTANT,
+                                value=_bg_value(color, img).tolist())
+        # single channel images come back without the channel axis
+        return res.reshape(shape)
+
+    if out is None:
+        out = np.empty(shape, dtype=img.dtype)
+    elif out.shape != shape:
+        raise ValueError('Output shape {} does not match {}'.format(out.shape, shape))
+
+    _fill_border(out, top, right, bottom, left, _bg_value(color, img))
+    out[top:top + h, left:left + w] = img
+    return out
+
+
+def pad_many(imgs, padding, color=COL_BLACK, out=None):
+    """
+    Pads a stack of same-sized images. eg: crops from crop_many
+
+    :param imgs: N x H x W (x C) array or list of H x W (x C) images
+    :param padding: constant padding around the images or [top right bottom left] padding.
+    :param color: Color of the padding
+    :param out: Output array to write to, of shape N x padded image shape
+    :return: N x padded image shape array (out if given)
+    """
+    top, right, bottom, left = _paddings(padding)
+    n = len(imgs)
+    img = imgs[0] if n > 0 else np.empty((0, 0), dtype=np.uint8)
+    h, w = img.shape[:2]
+    shape = (n, h + top + bottom, w + left + right) + img.shape[2:]
+
+    if out is None:
+        out = np.empty(shape, dtype=img.dtype)
+    elif out.shape != shape:
+        raise ValueError('Output shape {} does not match {}'.format(out.shape, shape))
+
+    _fill_border(out, top, right, bottom, left, _bg_value(color, img))
+    if isinstance(imgs, np.ndarray):
+        out[:, top:top + h, left:left + w] = imgs
+    else:
+        for i, img in enumerate(imgs):
+            out[i, top:top + h, left:left + w] = img
+    return out
 
 
 def img_box(img, box):
@@ -83,15 +172,20 @@ def img_box(img, box):
 
     :param img: Image to crop from
     :param box: Box to crop from. Box can be either Box object or array of [x, y, width, height]
-    :return: Cropped sub-image from the main image
+    :return: Cropped sub-image from the main image. (a view)
+        Smaller than the box if the box is not inside the image.
     """
     if isinstance(box, tuple):
         box = Box.from_tup(box)
 
+    # parts outside the image are cut off, negative indexes would wrap around
+    y, x = max(0, box.y), max(0, box.x)
+    y2, x2 = max(0, box.y + box.height), max(0, box.x + box.width)
+
     if len(img.shape) == 3:
-        return img[box.y:box.y + box.height, box.x:box.x + box.width, :]
+        return img[y:y2, x:x2, :]
     else:
-        return img[box.y:box.y + box.height, box.x:box.x + box.width]
+        return img[y:y2, x:x2]
 
 
 def set_img_box(img, box, value):
@@ -112,6 +206,102 @@ def set_img_box(img, box, value):
         img[box.y:box.y + box.height, box.x:box.x + box.width] = value
 
 
+def _boxes_int(boxes):
+    """ N x 4 int array of (x, y, width, height), rounded like Box.to_int """
+    if len(boxes) > 0 and isinstance(boxes[0], Box):
+        boxes = [box.to_tup() for box in boxes]
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    xy = np.rint(boxes[:, :2])
+    return np.hstack((xy, np.rint(boxes[:, :2] + boxes[:, 2:]) - xy)).astype(np.intp)
+
+
+def _clip_boxes(boxes, shape):
+    """ (x1, y1, x2, y2) of the boxes clipped to the image """
+    h, w = shape[:2]
+    x1, y1 = np.clip(boxes[:, 0], 0, w), np.clip(boxes[:, 1], 0, h)
+    x2 = np.clip(boxes[:, 0] + boxes[:, 2], x1, w)
+    y2 = np.clip(boxes[:, 1] + boxes[:, 3], y1, h)
+    return x1, y1, x2, y2
+
+
+def crop_many(img, boxes, out_size=None, bg=COL_BLACK):
+    """
+    Crops many boxes of an image into one contiguous N x H x W (x C) array.
+        Parts of the boxes outside the image are filled with the background color.
+
+    Without out_size all the boxes must have the same size, and the boxes inside the image are
+    gathered in a single indexing of a strided view of the image windows. With out_size each crop
+    is resized directly into its slot of the output.
+
+    :param img: Image to crop from
+    :param boxes: List of Box objects or N x 4 array of [x, y, width, height]
+    :param out_size: (width, height) to resize every crop to
+    :param bg: Background color for the parts outside the image
+    :return: N x H x W (x C) array of the crops
+    """
+    boxes = _boxes_int(boxes)
+    h, w = img.shape[:2]
+    channels = img.shape[2:]
+    fill = _bg_value(bg, img)
+
+    x1, y1, x2, y2 = _clip_boxes(boxes, img.shape)
+    inside = ((x1 == boxes[:, 0]) & (y1 == boxes[:, 1]) &
+              (x2 - x1 == boxes[:, 2]) & (y2 - y1 == boxes[:, 3]))
+
+    if out_size is None:
+        sizes = boxes[:, 2:]
+        if len(boxes) > 0 and (sizes != sizes[0]).any():
+            raise ValueError('Boxes of different sizes need an out_size')
+        bw, bh = sizes[0] if len(boxes) > 0 else (0, 0)
+
+        crops = np.empty((len(boxes), bh, bw) + channels, dtype=img.dtype)
+        if inside.any():
+            # every bh x bw window of the image, gathered at the box origins
+            windows = np.lib.stride_tricks.as_strided(
+                img, (h - bh + 1, w - bw + 1, bh, bw) + channels,
+                img.strides[:2] * 2 + img.strides[2:], writeable=False)
+            crops[inside] = windows[boxes[inside, 1], boxes[inside, 0]]
+
+        for i in np.flatnonzero(~inside):
+            x, y = boxes[i, :2]
+            crops[i] = fill
+            crops[i, y1[i] - y:y2[i] - y, x1[i] - x:x2[i] - x] = img[y1[i]:y2[i], x1[i]:x2[i]]
+        return crops
+
+    out_w, out_h = out_size
+    crops = np.empty((len(boxes), out_h, out_w) + channels, dtype=img.dtype)
+    for i, (x, y, bw, bh) in enumerate(boxes):
+        crop = img[y1[i]:y2[i], x1[i]:x2[i]]
+        if crop.size == 0:
+            crops[i] = fill
+            continue
+        if not inside[i]:
+            crop = cv.copyMakeBorder(crop, y1[i] - y, y + bh - y2[i], x1[i] - x, x + bw - x2[i],
+                                     cv.BORDER_CONSTANT, value=bg)
+        cv.resize(crop, (out_w, out_h), dst=crops[i], interpolation=cv.INTER_AREA)
+    return crops
+
+
+def set_img_boxes(img, boxes, values):
+    """
+    Updates many boxes of the image. Parts of the boxes outside the image are ignored.
+
+    :param img: Input image, updated in place
+    :param boxes: List of Box objects or N x 4 array of [x, y, width, height]
+    :param values: A value for all the boxes (eg: a color), or one image per box
+        (list or N x H x W (x C) array, eg: from crop_many) of the size of its box
+    """
+    boxes = _boxes_int(boxes)
+    x1, y1, x2, y2 = _clip_boxes(boxes, img.shape)
+    per_box = not np.isscalar(values) and len(values) == len(boxes) and np.ndim(values[0]) >= 2
+
+    for i, (x, y, _, _) in enumerate(boxes):
+        if per_box:
+            img[y1[i]:y2[i], x1[i]:x2[i]] = values[i][y1[i] - y:y2[i] - y, x1[i] - x:x2[i] - x]
+        else:
+            img[y1[i]:y2[i], x1[i]:x2[i]] = values
+
+
 def add_text_img(img, text, pos, box=None, color=None, thickness=1, scale=1, vertical=False):
     """
     Adds the given text in the image.
@@ -238,14 +428,13 @@ def collage(imgs, size, padding=10, bg=COL_BLACK):
     nrows, ncols = size
     nr, nc = nrows * h + (nrows-1) * padding, ncols * w + (ncols-1) * padding
 
-    res = np.ones((nr, nc, 3), dtype=np.uint8) * np.array(bg, dtype=np.uint8)
+    res = np.empty((nr, nc, 3), dtype=np.uint8)
+    res[:] = bg
 
     for r in range(nrows):
         for c in range(ncols):
-            img = imgs[r][c]
-
-            if is_gray(img):
-                img = gray3ch(img)
+            # gray-scale images are broadcast to the 3 channels
+            img = gray3(imgs[r][c])
 
             rs = r * (h + padding)
             re = rs + h
@@ -280,13 +469,187 @@ def gray3ch(img):
     return cv.cvtColor(img, cv.COLOR_GRAY2BGR) if is_gray(img) else img
 
 
-def each_img(img_dir):
+def each_img(img_dir, max_side=None):
     """
     Reads and iterates through each image file in the given directory
+
+    :param img_dir: Directory path where images files are present
+    :param max_side: If given, images are loaded with their maximum dimension within max_side.
+        (see imread)
     """
     for fname in utils.each_img(img_dir):
         fname = os.path.join(img_dir, fname)
-        yield cv.imread(fname), fname
+        yield imread(fname, max_side), fname
+
+
+def each_frame(video, stride=1, start=None, end=None, buffer_size=4, drop=False):
+    """
+    Decodes and iterates through the frames of a video on a background thread,
+        so that decoding overlaps with the processing of the previous frames.
+
+    Frames are decoded into a ring of buffer_size + 1 reused arrays.
+    A frame is only valid until the next one is requested, copy it to keep it.
+
+    :param video: Video file path, URL or camera index (see cv.VideoCapture)
+    :param stride: Yield every stride-th frame. Frames in between are skipped without decoding.
+    :param start: Start time in seconds
+    :param end: End time in seconds (exclusive)
+    :param buffer_size: Maximum number of decoded frames waiting to be processed
+    :param drop: If all the buffers are in use, skip frames instead of waiting. eg: live cameras
+    :return: Iterator of (frame, frame index, timestamp in seconds)
+    """
+    cap = cv.VideoCapture(video)
+    if not cap.isOpened():
+        raise IOError('Can not open video: {}'.format(video))
+    if start:
+        cap.set(cv.CAP_PROP_POS_MSEC, start * 1000)
+
+    free, ready = queue.Queue(), queue.Queue()
+    for _ in range(buffer_size + 1):
+        # arrays are allocated by the first decode into each slot
+        free.put(np.empty(0, dtype=np.uint8))
+
+    stop = threading.Event()
+    decoder = threading.Thread(target=_decode_frames,
+                               args=(cap, stride, end, drop, free, ready, stop))
+    decoder.daemon = True
+    decoder.start()
+
+    frame = None
+    try:
+        while True:
+            # the previous frame is done with
+            if frame is not None:
+                free.put(frame)
+
+            item = ready.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+
+            frame = item[0]
+            yield item
+    finally:
+        stop.set()
+        decoder.join()
+        cap.release()
+
+
+def _decode_frames(cap, stride, end, drop, free, ready, stop):
+    """ Decoder thread of each_frame. Puts (frame, index, timestamp), then None at the end """
+    try:
+        index = first = int(cap.get(cv.CAP_PROP_POS_FRAMES))
+        while not stop.is_set() and cap.grab():
+            index += 1
+            t = cap.get(cv.CAP_PROP_POS_MSEC) / 1000
+            if end is not None and t >= end:
+                break
+            if (index - 1 - first) % stride:
+                continue
+
+            buf = None
+            while buf is None and not stop.is_set():
+                try:
+                    buf = free.get_nowait() if drop else free.get(timeout=0.1)
+                except queue.Empty:
+                    if drop:
+                        break
+            if buf is None:
+                continue
+
+            ok, frame = cap.retrieve(buf if buf.size else None)
+            if not ok:
+                break
+            ready.put((frame, index - 1, t))
+    except Exception as e:
+        ready.put(e)
+        return
+    ready.put(None)
+
+
+# reduced resolution decode flags by reduction factor
+_REDUCED_COLOR = {2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4,
+                  8: cv.IMREAD_REDUCED_COLOR_8}
+_REDUCED_GRAY = {2: cv.IMREAD_REDUCED_GRAYSCALE_2, 4: cv.IMREAD_REDUCED_GRAYSCALE_4,
+                 8: cv.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def imread(fname, max_side=None, gray=False):
+    """
+    Reads an image file, optionally with its maximum dimension within max_side.
+        JPEG images are decoded directly at a reduced resolution (DCT scaling by 2, 4 or 8)
+        that is still larger than max_side, and then resized exactly.
+        Much faster than decoding at full resolution for large images.
+
+    :param fname: Image file path
+    :param max_side: Length of the maximum height or width. Images are never enlarged.
+    :param gray: Whether to read as a gray-scale image
+    :return: Image or None if it can not be read
+    """
+    flags = cv.IMREAD_GRAYSCALE if gray else cv.IMREAD_COLOR
+    if max_side is None:
+        return cv.imread(fname, flags)
+
+    size = jpeg_size(fname)
+    if size is not None:
+        factor = 8
+        while factor > 1 and max(size) < factor * max_side:
+            factor //= 2
+        if factor > 1:
+            flags = (_REDUCED_GRAY if gray else _REDUCED_COLOR)[factor]
+
+    img = cv.imread(fname, flags)
+    if img is not None and max(img.shape[:2]) > max_side:
+        img = resize_max(img, max_side)
+    return img
+
+
+def jpeg_size(fname):
+    """
+    Reads the (height, width) of a JPEG image from its header without decoding it.
+
+    :param fname: Image file path
+    :return: (height, width) or None if it is not a readable JPEG file
+    """
+    try:
+        with open(fname, 'rb') as f:
+            return _jpeg_size(f)
+    except (IOError, OSError):
+        # unreadable file, same as cv.imread
+        return None
+
+
+def _jpeg_size(f):
+    if f.read(2) != b'\xff\xd8':
+        return None
+
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0:1] != b'\xff':
+            return None
+        code = ord(marker[1:2])
+
+        # markers without payload
+        if code == 0xff:
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code == 0x01 or 0xd0 <= code <= 0xd9:
+            continue
+
+        seg = f.read(2)
+        if len(seg) < 2:
+            return None
+        length = (ord(seg[0:1]) << 8) + ord(seg[1:2])
+
+        # start of frame markers, except DHT, JPG and DAC
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            data = bytearray(f.read(5))
+            if len(data) < 5:
+                return None
+            return (data[1] << 8) + data[2], (data[3] << 8) + data[4]
+
+        f.seek(length - 2, os.SEEK_CUR)
 
 
 def resize_max(img, max_side):
@@ -304,7 +667,9 @@ def resize_max(img, max_side):
         nw = max_side
         nh = h * (nw / w)
 
-    return cv.resize(img, (nw, nh))
+    nw, nh = max(1, int(round(nw))), max(1, int(round(nh)))
+    interpolation = cv.INTER_AREA if max_side < max(h, w) else cv.INTER_LINEAR
+    return cv.resize(img, (nw, nh), interpolation=interpolation)
 
 
 def randomly_place(img, template):
@@ -328,3 +693,29 @@ def rot90(img):
     img = img.transpose((1,0,2))
     return cv.flip(img, 0)
 
+
+def rotate(img, angle, bg=COL_BLACK):
+    """
+    Rotates the image counter-clockwise by the given angle.
+        Multiples of 90 degrees are exact (rot90). For other angles, the canvas is enlarged
+        to fit the whole rotated image and the uncovered corners are filled with bg.
+
+    :param img: Input image
+    :param angle: Angle in degrees
+    :param bg: Background color for the uncovered corners
+    :return: Rotated image
+    """
+    angle %= 360
+    if angle % 90 == 0:
+        for _ in range(int(angle // 90)):
+            img = rot90(img)
+        return img
+
+    h, w = img.shape[:2]
+    mat = cv.getRotationMatrix2D((w / 2, h / 2), angle, 1)
+    cos, sin = abs(mat[0, 0]), abs(mat[0, 1])
+    nw = int(math.ceil(h * sin + w * cos))
+    nh = int(math.ceil(h * cos + w * sin))
+    mat[0, 2] += (nw - w) / 2
+    mat[1, 2] += (nh - h) / 2
+    return cv.warpAffine(img, mat, (nw, nh), borderValue=bg)
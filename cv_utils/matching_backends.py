@@ -0,0 +1,294 @@
+"""
+Backends for multi channel template matching (more than 3 channels)
+    and an autotuner to choose the fastest backend for an input size.
+
+Template and image can also be quantized feature maps (feature_extractor.quantize).
+The tunable backends dequantize them a few channels at a time.
+
+Every backend computes the same distance map of shape (H - h + 1, W - w + 1)
+between the template and each template-sized window of the image:
+    - euclidean: Euclidean distance between the flattened template and window
+    - correlation: Correlation distance (1 - Pearson correlation) between them
+"""
+from __future__ import division
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import cv2 as cv
+import scipy.fft
+import scipy.spatial
+
+from cv_utils import feature_extractor as fe
+
+
+DISTANCES = ('euclidean', 'correlation')
+
+_backends = dict()
+
+
+def register(name, tunable=True):
+    """
+    Decorator to register a matching backend function.
+        Backend function takes (template, image, distance) with 3-dimensional float arrays
+        and returns the distance map.
+
+    :param name: Name of the backend
+    :param tunable: Whether the autotuner should consider this backend
+    """
+    def _register(fn):
+        _backends[name] = (fn, tunable)
+        return fn
+    return _register
+
+
+def get(name):
+    """
+    :param name: Name of the backend
+    :return: Backend function
+    """
+    if name not in _backends:
+        raise ValueError('Unknown matching backend: {}'.format(name))
+    return _backends[name][0]
+
+
+def names(tunable_only=False):
+    return [name for name, (_, tunable) in _backends.items() if tunable or not tunable_only]
+
+
+def _window_sum(img, h, w):
+    """ Sum of every h x w window of a 2d image, using integral image """
+    ii = cv.integral(img, sdepth=cv.CV_64F)
+    return ii[h:, w:] - ii[:-h, w:] - ii[h:, :-w] + ii[:-h, :-w]
+
+
+def _float(arr, start=None, stop=None, dtype=np.float64):
+    """ Channels [start, stop) of a feature map as float. Quantized maps are dequantized """
+    if isinstance(arr, fe.QuantizedFeature):
+        return arr.dequantize(start, stop, dtype)
+    if start is not None or stop is not None:
+        arr = arr[:, :, start:stop]
+    return arr.astype(dtype, copy=False)
+
+
+def _chunks(arr, size=3, dtype=np.float32):
+    """ Iterates through float chunks of channels """
+    for c in range(0, arr.shape[2], size):
+        yield _float(arr, c, c + size, dtype)
+
+
+def _distance_map(cross, template, image, distance):
+    """
+    Computes the distance map from the cross-correlation of template and image windows.
+        Template and image are read a few channels at a time.
+    """
+    h, w, d = template.shape
+    n = h * w * d
+
+    sum_t = sum_t2 = 0
+    for chunk in _chunks(template):
+        sum_t += chunk.sum(dtype=np.float64)
+        sum_t2 += np.square(chunk, dtype=np.float64).sum()
+
+    sum_i = sum_i2 = 0
+    for chunk in _chunks(image):
+        sum_i = sum_i + chunk.sum(axis=2, dtype=np.float64)
+        sum_i2 = sum_i2 + np.square(chunk, dtype=np.float64).sum(axis=2)
+    sum_i2 = _window_sum(sum_i2, h, w)
+
+    if distance == 'euclidean':
+        sq = sum_i2 - 2 * cross + sum_t2
+        return np.sqrt(np.maximum(sq, 0, out=sq), out=sq)
+
+    sum_i = _window_sum(sum_i, h, w)
+
+    num = cross - sum_t * sum_i / n
+    den = (sum_t2 - sum_t * sum_t / n) * np.maximum(sum_i2 - sum_i * sum_i / n, 0)
+    np.sqrt(den, out=den)
+
+    # constant windows have no correlation
+    valid = den > 0
+    dist = np.ones(num.shape)
+    dist[valid] -= num[valid] / den[valid]
+    return dist
+
+
+@register('opencv')
+def opencv_sum(template, image, distance):
+    """ Cross-correlation as the sum of OpenCV matching of every 3-channel chunk """
+    cross = None
+    for t_chunk, i_chunk in zip(_chunks(template), _chunks(image)):
+        res = cv.matchTemplate(i_chunk, t_chunk, cv.TM_CCORR)
+        cross = res.astype(np.float64) if cross is None else cross + res
+    return _distance_map(cross, template, image, distance)
+
+
+@register('numpy')
+def numpy_direct(template, image, distance):
+    """
+    Cross-correlation by accumulating, for every template row, the products of the
+        template row with the row-wide windows of the shifted image rows
+    """
+    h, w, d = template.shape
+    im_h, im_w = image.shape[:2]
+    oh, ow = im_h - h + 1, im_w - w + 1
+
+    cross = np.zeros((oh, ow))
+    for t_chunk, i_chunk in zip(_chunks(template, dtype=np.float64),
+                                _chunks(image, dtype=np.float64)):
+        # channel slices of float maps are views with the stride of all the channels
+        i_chunk = np.ascontiguousarray(i_chunk)
+        s_row, s_col, s_ch = i_chunk.strides
+        for row in range(h):
+            # oh x ow x w x channels view of the windows of the template row
+            windows = np.lib.stride_tricks.as_strided(
+                i_chunk[row:], (oh, ow, w, i_chunk.shape[2]), (s_row, s_col, s_col, s_ch),
+                writeable=False)
+            cross += np.einsum('ijwc,wc->ij', windows, t_chunk[row])
+    return _distance_map(cross, template, image, distance)
+
+
+@register('fft')
+def fft(template, image, distance):
+    """
+    Cross-correlation using FFT over the spatial axes. The spectrum products of every
+        channel chunk are summed, so that one inverse transform gives the cross-correlation.
+    """
+    h, w = template.shape[:2]
+    im_h, im_w = image.shape[:2]
+    # valid windows do not wrap around with a transform of at least the image size
+    shape = scipy.fft.next_fast_len(im_h, True), scipy.fft.next_fast_len(im_w, True)
+
+    spectrum = 0
+    for t_chunk, i_chunk in zip(_chunks(template, dtype=np.float64),
+                                _chunks(image, dtype=np.float64)):
+        t_fft = scipy.fft.rfft2(t_chunk[::-1, ::-1], shape, axes=(0, 1))
+        t_fft *= scipy.fft.rfft2(i_chunk, shape, axes=(0, 1))
+        spectrum = spectrum + t_fft.sum(axis=2)
+    cross = scipy.fft.irfft2(spectrum, shape)[h - 1:im_h, w - 1:im_w]
+    return _distance_map(cross, template, image, distance)
+
+
+@register('loop', tunable=False)
+def loop(template, image, distance):
+    """ Reference implementation comparing every window with scipy distances (slow) """
+    template = _float(template)
+    image = _float(image)
+
+    h, w, d = template.shape
+    im_h, im_w = image.shape[:2]
+
+    template_v = template.flatten()
+
+    heatmap = np.zeros((im_h - h + 1, im_w - w + 1))
+    for col in range(0, im_w - w + 1):
+        for row in range(0, im_h - h + 1):
+            cropped_im = image[row:row + h, col:col + w, :]
+            cropped_v = cropped_im.flatten()
+
+            if distance == 'euclidean':
+                heatmap[row, col] = scipy.spatial.distance.euclidean(template_v, cropped_v)
+            elif distance == 'correlation':
+                heatmap[row, col] = scipy.spatial.distance.correlation(template_v, cropped_v)
+
+    return heatmap
+
+
+class Autotuner(object):
+    """
+    Chooses the fastest backend for a (template shape, image shape, channels, distance)
+        by running all the tunable backends once on the first input of that kind.
+        The choices can be persisted in a JSON file and are reused by later runs.
+
+    Thread-safe, eg: for the executor threads of async_matching.AsyncMatcher.
+    Threads tuning the same new input at once each benchmark it, the last choice is kept.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: JSON file to load and save the choices. In-memory only if None.
+        """
+        self.path = path
+        self.choices = dict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.choices = json.load(f)
+
+    @staticmethod
+    def key(template, image, distance):
+        h, w, d = template.shape
+        im_h, im_w = image.shape[:2]
+        key = '{}x{}|{}x{}|{}|{}'.format(h, w, im_h, im_w, d, distance)
+        # quantized inputs have different costs
+        if isinstance(image, fe.QuantizedFeature):
+            key += '|uint8'
+        elif image.dtype == np.float16:
+            key += '|float16'
+        return key
+
+    def match(self, template, image, distance):
+        """
+        Matches using the fastest known backend. Unknown inputs are benchmarked first.
+
+        :return: Distance map
+        """
+        key = self.key(template, image, distance)
+        with self._lock:
+            choice = self.choices.get(key)
+        if choice is not None:
+            return get(choice)(template, image, distance)
+
+        best, best_time, result = None, None, None
+        for name in names(tunable_only=True):
+            start = time.time()
+            res = get(name)(template, image, distance)
+            elapsed = time.time() - start
+            if best is None or elapsed < best_time:
+                best, best_time, result = name, elapsed, res
+
+        with self._lock:
+            self.choices[key] = best
+        self.save()
+        return result
+
+    def save(self, path=None):
+        """
+        Writes the choices to the given path or to the path of the autotuner.
+        """
+        path = path or self.path
+        if path is None:
+            return
+
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        # write and rename, so that concurrent processes never read a partial file.
+        # the lock keeps the saves of the threads in order and the choices unchanged meanwhile
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.choices, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, path)
+
+
+autotuner = Autotuner(os.environ.get('CV_UTILS_TUNING_FILE'))
+
+
+def match(template, image, distance, backend='auto'):
+    """
+    Multi channel template matching with the given backend.
+
+    :param template: 3-dimensional template features
+    :param image: 3-dimensional image features
+    :param distance: 'euclidean' or 'correlation'
+    :param backend: Name of the backend or 'auto' to use the autotuner
+    :return: Distance map
+    """
+    if backend == 'auto':
+        return autotuner.match(template, image, distance)
+    return get(backend)(template, image, distance)
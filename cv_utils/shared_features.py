@@ -0,0 +1,167 @@
+"""
+Sharing a search image and its features with worker processes through shared memory.
+
+The parent extracts the features once and publishes them with SharedFeatures. The small,
+picklable handle is sent to the workers, which attach to the blocks as zero-copy numpy views
+and pass the handle as the search image to match_one, multi_feat_match or feature_match.
+
+    with SharedFeatures(image, options) as shared:
+        handle = shared.handle()
+        results = pool.map(functools.partial(match_in_worker, handle), templates)
+
+    def match_in_worker(handle, template):
+        return template_matching.match_one(template, handle, options)
+"""
+from __future__ import division
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cv_utils import template_matching as tm, feature_extractor as fe
+
+
+class SharedArray(object):
+    """
+    Picklable description of a numpy array in a shared memory block.
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def publish(cls, arr):
+        """
+        Copies the array into a new shared memory block.
+
+        :param arr: numpy array
+        :return: (SharedArray, SharedMemory) The caller owns the block and has to unlink it.
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        return cls(shm.name, arr.shape, arr.dtype.str), shm
+
+    def attach(self):
+        """
+        :return: (view, SharedMemory) The block has to be kept open as long as the view is used.
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        view = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf)
+        return view, shm
+
+
+class SharedFeaturesHandle(object):
+    """
+    Handle to the shared image and features, to be sent to worker processes.
+        Can be used in place of the search image in the template matching functions.
+    """
+
+    def __init__(self, image, features):
+        self.image = image
+        # feature key -> (SharedArray, scale, offset), scale and offset for quantized features
+        self.features = features
+        self._blocks = None
+        self._context = None
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def __getstate__(self):
+        return self.image, self.features
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def feature_context(self):
+        """
+        Attaches to the shared blocks on first use.
+
+        :return: feature_extractor.FeatureContext with views of the image and the features
+        """
+        if self._context is None:
+            self._blocks = []
+            img = self._attach(self.image)
+
+            features = dict()
+            for key, (arr, scale, offset) in self.features.items():
+                data = self._attach(arr)
+                features[key] = data if scale is None else fe.QuantizedFeature(data, scale, offset)
+
+            self._context = fe.FeatureContext(img, features)
+        # new context per use, so that releasing it does not affect the shared features
+        return fe.FeatureContext(self._context.img, self._context.features)
+
+    def _attach(self, arr):
+        view, shm = arr.attach()
+        self._blocks.append(shm)
+        return view
+
+    def detach(self):
+        """
+        Closes the blocks attached in this process. Views obtained before must not be used.
+        """
+        self._context = None
+        for shm in self._blocks or []:
+            shm.close()
+        self._blocks = None
+
+
+class SharedFeatures(object):
+    """
+    Owner of the shared memory blocks of an image and its features.
+        The blocks are removed by close() or at the end of the with block.
+    """
+
+    def __init__(self, image, options=None):
+        """
+        :param image: Search image
+        :param options: Matching options. Features of each feature option are extracted.
+        """
+        self._blocks = []
+        try:
+            image_arr = self._publish(image)
+
+            features = dict()
+            with fe.FeatureContext(image) as ctx:
+                for op in tm._feature_options(options):
+                    feat = tm.extract(ctx, op)
+                    if isinstance(feat, fe.QuantizedFeature):
+                        features[tm.feature_key(op)] = (self._publish(feat.data),
+                                                        feat.scale, feat.offset)
+                    else:
+                        features[tm.feature_key(op)] = (self._publish(feat), None, None)
+        except Exception:
+            self.close()
+            raise
+
+        self._handle = SharedFeaturesHandle(image_arr, features)
+
+    def _publish(self, arr):
+        shared, shm = SharedArray.publish(np.ascontiguousarray(arr))
+        self._blocks.append(shm)
+        return shared
+
+    def handle(self):
+        """
+        :return: Picklable SharedFeaturesHandle
+        """
+        return self._handle
+
+    def close(self):
+        """
+        Closes and removes all the shared blocks.
+        """
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
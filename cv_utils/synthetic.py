@@ -0,0 +1,150 @@
+"""
+Synthetic search images for load and accuracy testing of template matching.
+
+Templates are placed at random positions of batches of search images, with random
+rotation (90 degree steps), contrast, brightness and noise. All the samples of a batch are
+generated together as one contiguous N x H x W x C array, and every batch is reproducible
+from (seed, batch index) alone.
+"""
+from __future__ import division
+
+import numpy as np
+
+from cv_utils import Box
+
+
+_DEF_SYN_OPTS = dict(rotate=True,
+                     contrast=(0.8, 1.2),
+                     brightness=(-30, 30),
+                     noise=5.0)
+
+# number of images augmented together
+_CHUNK = 64
+
+
+def generate(templates, n, size, bg=None, seed=None, options=None):
+    """
+    Generates a batch of search images with one template placed in each image.
+
+    :param templates: Template image or list of template images (same number of channels)
+    :param n: Number of search images
+    :param size: (height, width) of the search images
+    :param bg: Background image of the given size. Random noise background if None.
+    :param seed: Seed of the random generator. An int or a sequence of ints.
+    :param options: Augmentation options:
+        - rotate: Randomly rotate the templates by multiples of 90 degree. Default: True
+        - contrast: (min, max) of the random contrast factor or None. Default: (0.8, 1.2)
+        - brightness: (min, max) of the random brightness offset or None. Default: (-30, 30)
+        - noise: Standard deviation of the (approximately gaussian) noise or 0. Default: 5.0
+    :return: (images, boxes, ids)
+        images: N x H x W x C uint8 array
+        boxes: Ground truth Box of the template in each image
+        ids: Index of the template placed in each image
+    """
+    op = _DEF_SYN_OPTS.copy()
+    if options is not None:
+        op.update(options)
+
+    if not isinstance(templates, (list, tuple)):
+        templates = [templates]
+    templates = [t[:, :, np.newaxis] if t.ndim == 2 else t for t in templates]
+
+    rng = np.random.RandomState(seed)
+    h, w = size
+    d = templates[0].shape[2]
+
+    if bg is None:
+        images = rng.randint(0, 256, size=(n, h, w, d), dtype=np.uint8)
+    else:
+        bg = bg.reshape(h, w, d)
+        images = np.empty((n, h, w, d), dtype=np.uint8)
+        images[:] = bg
+
+    ids = rng.randint(0, len(templates), size=n)
+    rots = rng.randint(0, 4, size=n) if op['rotate'] else np.zeros(n, dtype=int)
+
+    xs = np.zeros(n, dtype=int)
+    ys = np.zeros(n, dtype=int)
+    ws = np.zeros(n, dtype=int)
+    hs = np.zeros(n, dtype=int)
+
+    # place all the samples sharing the same template and rotation at once
+    for tid, template in enumerate(templates):
+        for k in range(4):
+            idx = np.flatnonzero((ids == tid) & (rots == k))
+            if idx.size == 0:
+                continue
+
+            rotated = np.rot90(template, k)
+            th, tw = rotated.shape[:2]
+            if th > h or tw > w:
+                raise ValueError('Template {} does not fit in the image size {}'.format(tid, size))
+
+            ys[idx] = rng.randint(0, h - th + 1, size=idx.size)
+            xs[idx] = rng.randint(0, w - tw + 1, size=idx.size)
+            hs[idx], ws[idx] = th, tw
+
+            rows = ys[idx, np.newaxis, np.newaxis] + np.arange(th)[np.newaxis, :, np.newaxis]
+            cols = xs[idx, np.newaxis, np.newaxis] + np.arange(tw)[np.newaxis, np.newaxis, :]
+            images[idx[:, np.newaxis, np.newaxis], rows, cols] = rotated
+
+    _augment(images, rng, op)
+
+    boxes = [Box(int(x), int(y), int(bw), int(bh)) for x, y, bw, bh in zip(xs, ys, ws, hs)]
+    return images, boxes, ids
+
+
+def _augment(images, rng, op):
+    """ Applies contrast, brightness and noise on the whole batch in-place """
+    n = images.shape[0]
+    alpha = np.ones((n, 1, 1, 1), dtype=np.float32)
+    beta = np.zeros((n, 1, 1, 1), dtype=np.float32)
+    if op['contrast'] is not None:
+        alpha[:] = rng.uniform(op['contrast'][0], op['contrast'][1], size=alpha.shape)
+    if op['brightness'] is not None:
+        beta[:] = rng.uniform(op['brightness'][0], op['brightness'][1], size=beta.shape)
+
+    if not op['noise'] and op['contrast'] is None and op['brightness'] is None:
+        return
+
+    # chunks of samples, to limit the size of the float temporary
+    for s in range(0, n, _CHUNK):
+        e = min(n, s + _CHUNK)
+        imgs = images[s:e].astype(np.float32)
+        imgs *= alpha[s:e]
+        imgs += beta[s:e]
+        if op['noise']:
+            imgs += _noise(rng, op['noise'], imgs.shape)
+        np.clip(imgs, 0, 255, out=imgs)
+        images[s:e] = imgs
+
+
+def _noise(rng, std, shape):
+    """
+    Triangular noise, the sum of two uniform integer noises, with the given standard deviation.
+        Close to gaussian and several times faster to generate than rng.normal.
+    """
+    a = min(127, max(1, int(round((np.sqrt(1 + 6 * std * std) - 1) / 2))))
+    noise = rng.randint(-a, a + 1, size=shape, dtype=np.int8).astype(np.float32)
+    noise += rng.randint(-a, a + 1, size=shape, dtype=np.int8)
+    return noise
+
+
+def batches(templates, size, batch_size, n_batches=None, bg=None, seed=0, options=None):
+    """
+    Iterates through reproducible batches of synthetic search images.
+        Batch i is generated with the seed (seed, i), so any batch can be regenerated alone.
+
+    :param templates: Template image or list of template images
+    :param size: (height, width) of the search images
+    :param batch_size: Number of images in each batch
+    :param n_batches: Number of batches. Infinite if None.
+    :param bg: Background image. Random noise background if None.
+    :param seed: Base seed
+    :param options: Augmentation options. (see generate)
+    :return: Iterator of (images, boxes, ids)
+    """
+    i = 0
+    while n_batches is None or i < n_batches:
+        yield generate(templates, batch_size, size, bg, (seed, i), options)
+        i += 1
@@ -1,19 +1,33 @@
 from __future__ import division
 
+import collections
+import hashlib
+import json
+import math
+import os
+import pickle
+import threading
+
 import numpy as np
 import cv2 as cv
-import scipy.spatial
 
-from cv_utils import Box, img_utils, feature_extractor as fe
+from cv_utils import Box, img_utils, feature_extractor as fe, matching_backends as backends
 
 
 _DEF_TM_OPT = dict(feature='rgb',
                    distance='correlation',
                    normalize=True,
-                   retain_size=True)
+                   relative=True,
+                   retain_size=True,
+                   backend='auto',
+                   projection=None,
+                   quantize=None)
+
+# opt-in result cache, see enable_cache
+result_cache = None
 
 
-def match_one(template, image, options=None):
+def match_one(template, image, options=None, roi=None):
     """
     Match template and find exactly one match in the Image using specified features.
 
@@ -21,16 +35,38 @@ def match_one(template, image, options=None):
     :param image: Search Image
     :param options: Options include
         - features: List of options for each feature
+    :param roi: Box where the object is expected. eg: a previous detection.
+        If given, only the region around it is searched. (see search_region)
     :return: (Box, Score) Bounding box of the matched object, Heatmap value
     """
-    heatmap, scale = multi_feat_match(template, image, options)
+    cache = result_cache
+    if cache is not None:
+        key = cache.key('match_one{}'.format(roi), template, image, options)
+        result = cache.get(key)
+        if result is not None:
+            return result
 
-    min_val, _, min_loc, _ = cv.minMaxLoc(heatmap)
-    top_left = tuple(scale * x for x in min_loc)
-    score = min_val
+    if roi is not None:
+        image, region = _crop_region(template, image, roi, options)
+
+    heatmap, scale = _multi_feat_match(template, image, options)
 
     h, w = template.shape[:2]
-    return Box(top_left[0], top_left[1], w, h), score
+    result = _best_match(heatmap, scale, w, h)
+
+    # back to the full image co-ordinates
+    if roi is not None:
+        result = result[0].move(region.top_left()), result[1]
+
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+def _best_match(heatmap, scale, w, h):
+    min_val, _, min_loc, _ = cv.minMaxLoc(heatmap)
+    top_left = tuple(scale * x for x in min_loc)
+    return Box(top_left[0], top_left[1], w, h), min_val
 
 
 def multi_feat_match(template, image, options=None):
@@ -38,63 +74,474 @@ def multi_feat_match(template, image, options=None):
     Match template and image by extracting multiple features (specified) from it.
 
     :param template: Template image
-    :param image:  Search image
+    :param image:  Search image or shared_features.SharedFeaturesHandle
     :param options: Options include
         - features: List of options for each feature
-    :return:
+    :return: (Heatmap, Scale)
     """
+    cache = result_cache
+    if cache is not None:
+        key = cache.key('multi_feat_match', template, image, options)
+        result = cache.get(key)
+        if result is not None:
+            # copy, so that the caller can not modify the cached heatmap
+            return result[0].copy(), result[1]
+
+    result = _multi_feat_match(template, image, options)
+
+    if cache is not None:
+        cache.put(key, (result[0].copy(), result[1]), result[0].nbytes)
+    return result
+
+
+def _multi_feat_match(template, image, options):
     h, w = image.shape[:2]
     scale = 1
     if options is not None and 'features' in options:
-        heatmap = np.zeros((h, w), dtype=np.float64)
-        for foptions in options['features']:
-            f_hmap, _ = feature_match(template, image, foptions)
-            heatmap += cv.resize(f_hmap, (w, h), interpolation=cv.INTER_AREA)
-        heatmap /= len(options['features'])
+        # share the gray-scale and color conversions of the images between the features
+        with fe.FeatureContext.of(template) as tmpl_ctx, fe.FeatureContext.of(image) as img_ctx:
+            heatmap = np.zeros((h, w), dtype=np.float64)
+            for foptions in options['features']:
+                f_hmap, _ = feature_match(tmpl_ctx, img_ctx, foptions)
+                heatmap += cv.resize(f_hmap, (w, h), interpolation=cv.INTER_AREA)
+            heatmap /= len(options['features'])
     else:
         heatmap, scale = feature_match(template, image, options)
     return heatmap, scale
 
 
-def feature_match(template, image, options=None):
+def search_region(image_shape, template_shape, roi, options=None):
+    """
+    Region of the image to extract features from, to find matches overlapping the roi.
+        The roi is padded by the template size and by the receptive field of the features.
+        Its top-left and size are aligned to the feature stride (HOG cell size), so that the
+        features of the region are the same as those of the full image, and the scale of the
+        region heatmap is the stride whatever the padding. (except at the image border)
+
+    :param image_shape: Shape of the search image
+    :param template_shape: Shape of the template
+    :param roi: Box where the object is expected
+    :param options: Matching options. For features other than HOG, the 'stride' and
+        'receptive_field' options (in pixels) can be given. eg: for deep network layers
+    :return: Box of the region
+    """
+    h, w = image_shape[:2]
+    th, tw = template_shape[:2]
+
+    margin, align = 0, 1
+    for op in _feature_options(options):
+        f_margin, f_align = _receptive_field(op)
+        margin = max(margin, f_margin)
+        align = align * f_align // math.gcd(align, f_align)
+
+    # keep at least a template-sized region inside the image
+    x = min(max(0, roi.x - tw - margin), max(0, w - tw))
+    y = min(max(0, roi.y - th - margin), max(0, h - th))
+    x, y = int(x - x % align), int(y - y % align)
+    x2 = _aligned_end(x, max(x + tw, roi.x + roi.width + tw + margin), w, tw, align)
+    y2 = _aligned_end(y, max(y + th, roi.y + roi.height + th + margin), h, th, align)
+    return Box(x, y, x2 - x, y2 - y)
+
+
+def _aligned_end(start, end, limit, min_size, align):
+    """ End of a range from start covering end, with a size multiple of align if possible """
+    size = int(math.ceil((end - start) / align)) * align
+    if start + size > limit:
+        size = (limit - start) // align * align
+    # the image border can not be aligned
+    if size < min_size:
+        size = limit - start
+    return start + size
+
+
+def _receptive_field(op):
+    """ (receptive field, stride) in pixels of the feature in the options """
+    if op['feature'] == 'hog':
+        hog_op = fe._DEF_HOG_OPTS.copy()
+        hog_op.update(op)
+        cx, cy = hog_op['cell_size']
+        bx, by = hog_op['block_size']
+        return max(cx * bx, cy * by), cx * cy // math.gcd(cx, cy)
+    return op.get('receptive_field', 0), op.get('stride', 1)
+
+
+def _crop_region(template, image, roi, options):
+    region = search_region(image.shape, template.shape, roi, options)
+    return img_utils.img_box(fe.FeatureContext.of(image).img, region), region
+
+
+def feature_match(template, image, options=None, roi=None):
     """
     Match template and image by extracting specified feature
 
-    :param template: Template image
-    :param image: Search image
+    :param template: Template image or feature_extractor.FeatureContext
+    :param image: Search image, feature_extractor.FeatureContext
+        or shared_features.SharedFeaturesHandle
     :param options: Options include
         - feature: Feature extractor to use. Default is 'rgb'. Available options are:
             'hog', 'lab', 'rgb', 'gray'
-    :return: Heatmap
+        - projection: Reduce the feature channels with a projection. (see extract)
+        - quantize: Quantize the features to save memory, 'uint8' or 'float16'. (see extract)
+    :param roi: Box where the object is expected. If given, only the region around it is
+        extracted and matched, and the heatmap covers that region:
+        search_region(image.shape, template.shape, roi, options)
+    :return: (Heatmap, Scale)
     """
     op = _DEF_TM_OPT.copy()
     if options is not None:
         op.update(options)
 
-    feat = fe.factory(op['feature'])
-    tmpl_f = feat(template, op)
-    img_f = feat(image, op)
+    if roi is not None:
+        image, _ = _crop_region(template, image, roi, options)
+
+    tmpl_ctx = fe.FeatureContext.of(template)
+    img_ctx = fe.FeatureContext.of(image)
+
+    tmpl_f = extract(tmpl_ctx, op)
+    img_f = extract(img_ctx, op)
+
+    # release only the contexts created here, the caller owns the others
+    if tmpl_ctx is not template:
+        tmpl_ctx.release()
+    if img_ctx is not image:
+        img_ctx.release()
 
     scale = image.shape[0] / img_f.shape[0]
     heatmap = match_template(tmpl_f, img_f, op)
     return heatmap, scale
 
 
+class MatchCache(object):
+    """
+    Cache of matching results keyed by the content of template and image and the options.
+        Recently used results are kept in memory within a byte-size limit.
+        Optionally, all the results are also stored in a directory and survive restarts.
+
+    Use enable_cache to cache the results of match_one and multi_feat_match.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, path=None):
+        """
+        :param max_bytes: Maximum total size of the in-memory results
+        :param path: Directory to store the results on disk. Memory only if None.
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(kind, template, image, options):
+        """
+        Hash of the array contents and the options merged with the defaults.
+
+        :param kind: Kind of the result. eg: 'match_one'
+        :return: Hex digest
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(kind.encode())
+        h.update(json.dumps(_feature_options(options), sort_keys=True, default=str).encode())
+        h.update(str('features' in (options or {})).encode())
+        for arr in (template, image):
+            if not isinstance(arr, np.ndarray):
+                arr = fe.FeatureContext.of(arr).img
+            arr = np.ascontiguousarray(arr)
+            h.update('{}{}'.format(arr.dtype, arr.shape).encode())
+            h.update(memoryview(arr).cast('B'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        :return: Cached result or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        if self.path is not None:
+            fname = os.path.join(self.path, key)
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    result = pickle.load(f)
+                with self._lock:
+                    self.hits += 1
+                self._remember(key, result, _result_size(result))
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result, nbytes=None):
+        """
+        Stores the result in memory and on disk.
+
+        :param nbytes: Size of the result. Estimated if None.
+        """
+        if nbytes is None:
+            nbytes = _result_size(result)
+        self._remember(key, result, nbytes)
+
+        if self.path is not None:
+            fname = os.path.join(self.path, key)
+            # one temp file per thread, so that concurrent puts of the same key never share one
+            tmp_fname = '{}.{}.{}.tmp'.format(fname, os.getpid(), threading.get_ident())
+            with open(tmp_fname, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fname, fname)
+
+    def _remember(self, key, result, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (result, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.nbytes -= size
+
+    def clear(self):
+        """
+        Clears the in-memory results and the counters. Results on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _result_size(result):
+    # object overhead of a (Box, score) or (heatmap, scale) result
+    size = 200
+    if isinstance(result[0], np.ndarray):
+        size += result[0].nbytes
+    return size
+
+
+def enable_cache(max_bytes=256 * 1024 * 1024, path=None):
+    """
+    Enables caching of match_one and multi_feat_match results.
+
+    :param max_bytes: Maximum total size of the in-memory results
+    :param path: Directory to store the results on disk. Memory only if None.
+    :return: The MatchCache, to look at its hits and misses
+    """
+    global result_cache
+    result_cache = MatchCache(max_bytes, path)
+    return result_cache
+
+
+def disable_cache():
+    global result_cache
+    result_cache = None
+
+
+class TemplateBank(object):
+    """
+    Rotated versions of a template with their features extracted up-front,
+        to find a template in any of the given orientations. (see match_rotated)
+        Bank can be built once and reused for many search images.
+    """
+
+    def __init__(self, template, options=None, angles=(0, 90, 180, 270)):
+        """
+        :param template: Template image
+        :param options: Same as match_one options. Either single feature or 'features'
+        :param angles: Rotation angles in degrees (counter-clockwise).
+            Multiples of 90 are exact, others are rotated on an enlarged canvas.
+        """
+        self.options = options
+        self.multi = options is not None and 'features' in options
+        self.feat_ops = _feature_options(options)
+
+        # (angle, (height, width), features of each feature option)
+        self.entries = []
+        for angle in angles:
+            rotated = img_utils.rotate(template, angle)
+            with fe.FeatureContext(rotated) as ctx:
+                feats = [extract(ctx, op) for op in self.feat_ops]
+            self.entries.append((angle, rotated.shape[:2], feats))
+
+
+def match_rotated(template, image, options=None, angles=(0, 90, 180, 270)):
+    """
+    Match template in all the given orientations and find the best one match.
+        The search image features are extracted only once and shared by all the rotations.
+
+    :param template: Template image or a prebuilt TemplateBank
+    :param image: Search image
+    :param options: Same as match_one. Ignored if template is a TemplateBank.
+    :param angles: Rotation angles in degrees. Ignored if template is a TemplateBank.
+    :return: (Box, Score, Angle) Bounding box of the rotated match, Heatmap value,
+        Angle by which the template was rotated to match
+    """
+    bank = template
+    if not isinstance(bank, TemplateBank):
+        bank = TemplateBank(template, options, angles)
+
+    # absolute scores to compare the rotations with each other
+    feat_ops = [dict(op, relative=False) for op in bank.feat_ops]
+
+    h, w = image.shape[:2]
+    with fe.FeatureContext.of(image) as ctx:
+        img_feats = [extract(ctx, op) for op in feat_ops]
+
+    best = None
+    for angle, (th, tw), tmpl_feats in bank.entries:
+        # rotated template does not fit in the image
+        if th > h or tw > w:
+            continue
+
+        heatmaps = [match_template(tmpl_f, img_f, op)
+                    for tmpl_f, img_f, op in zip(tmpl_feats, img_feats, feat_ops)]
+        heatmap, scale = _merge_heatmaps(heatmaps, img_feats, bank.multi, image.shape)
+
+        box, score = _best_match(heatmap, scale, tw, th)
+        if best is None or score < best[1]:
+            best = box, score, angle
+
+    return best
+
+
+def match_video(template, video, options=None, track=False, **frame_options):
+    """
+    Match template in each frame of a video.
+        Frames are decoded on a background thread while the previous frames are matched,
+        so the throughput is that of the slower of decoding and matching.
+
+    :param template: Template Image
+    :param video: Video file path, URL or camera index
+    :param options: Matching options (see match_one)
+    :param track: Search only around the match of the previous frame. (see match_one roi)
+    :param frame_options: stride, start, end, buffer_size and drop (see img_utils.each_frame)
+    :return: Iterator of (Box, Score, frame index, timestamp in seconds)
+    """
+    roi = None
+    for frame, index, t in img_utils.each_frame(video, **frame_options):
+        box, score = match_one(template, frame, options, roi)
+        if track:
+            roi = box
+        yield box, score, index, t
+
+
+def _merge_heatmaps(heatmaps, img_feats, multi, shape):
+    """
+    Combines the heatmaps of each feature, same as multi_feat_match.
+
+    :param heatmaps: Heatmap of each feature
+    :param img_feats: Search image features of each feature
+    :param multi: Whether the heatmaps came from the 'features' option
+    :param shape: Shape of the search image
+    :return: (Heatmap, Scale)
+    """
+    h, w = shape[:2]
+    if not multi:
+        return heatmaps[0], h / img_feats[0].shape[0]
+
+    heatmap = np.zeros((h, w), dtype=np.float64)
+    for f_hmap in heatmaps:
+        heatmap += cv.resize(f_hmap, (w, h), interpolation=cv.INTER_AREA)
+    heatmap /= len(heatmaps)
+    return heatmap, 1
+
+
+def _feature_options(options):
+    """ Default options merged with the options of each feature to match with """
+    if options is not None and 'features' in options:
+        options = options['features']
+    else:
+        options = [options]
+
+    feat_ops = []
+    for foptions in options:
+        op = _DEF_TM_OPT.copy()
+        if foptions is not None:
+            op.update(foptions)
+        feat_ops.append(op)
+    return feat_ops
+
+
+def extract(img, options=None):
+    """
+    Extracts the feature specified in the options.
+
+    :param img: Image or feature_extractor.FeatureContext
+    :param options: Options include
+        - feature: Feature extractor to use. Default is 'rgb'
+        - projection: feature_extractor.Projection or path of a saved one, to reduce the number
+            of channels. Default: None
+        - quantize: None, 'uint8' or 'float16'. Quantized features take 8 (uint8) or 4 (float16)
+            times less memory than float64 features and can be matched directly. Default: None
+    :return: Feature map
+    """
+    op = _DEF_TM_OPT.copy()
+    if options is not None:
+        op.update(options)
+
+    # already extracted. eg: shared by another process
+    if isinstance(img, fe.FeatureContext):
+        feat = img.features.get(feature_key(op))
+        if feat is not None:
+            return feat
+
+    feat = fe.factory(op['feature'])(img, op)
+    if op['projection'] is not None:
+        feat = fe.projection(op['projection']).transform(feat)
+    if op['quantize'] is not None:
+        feat = fe.quantize(feat, op['quantize'])
+    return feat
+
+
+# options that do not affect the extracted features
+_MATCH_OPTS = ('distance', 'normalize', 'relative', 'retain_size', 'backend', 'features')
+
+
+def feature_key(options):
+    """
+    Key to identify the features extracted with the given options.
+
+    :param options: Matching options of a single feature
+    :return: String key
+    """
+    op = _DEF_TM_OPT.copy()
+    if options is not None:
+        op.update(options)
+    op = dict((k, v) for k, v in op.items() if k not in _MATCH_OPTS)
+    return json.dumps(op, sort_keys=True, default=str)
+
+
 def match_template(template, image, options=None):
     """
     Multi channel template matching using simple correlation distance
 
-    :param template: Template image
-    :param image: Search image
+    :param template: Template image or features. Features can be quantized.
+    :param image: Search image or features. Features can be quantized.
     :param options: Other options:
         - distance: Distance measure to use. Default: 'correlation'
         - normalize: Heatmap values will be in the range of 0 to 1. Default: True
+        - relative: Heatmap values are relative to the worst match in the image. If False,
+            absolute distances are kept, to compare scores of different templates. Default: True
         - retain_size: Whether to retain the same size as input image. Default: True
+        - backend: Matching backend for more than 3 channels. 'opencv', 'numpy', 'fft', 'loop'
+            or 'auto' to choose the fastest one. (see matching_backends) Default: 'auto'
     :return: Heatmap
     """
     # If the input has max of 3 channels, use the faster OpenCV matching
-    if len(image.shape) <= 3 and image.shape[2] <= 3:
-        return match_template_opencv(template, image, options)
+    if len(image.shape) == 2 or image.shape[2] <= 3:
+        return match_template_opencv(fe.dequantize(template), fe.dequantize(image), options)
 
     op = _DEF_TM_OPT.copy()
     if options is not None:
@@ -103,24 +550,13 @@ def match_template(template, image, options=None):
     template = img_utils.gray3(template)
     image = img_utils.gray3(image)
 
-    h, w, d = template.shape
-    im_h, im_w = image.shape[:2]
-
-    template_v = template.flatten()
-
-    heatmap = np.zeros((im_h - h, im_w - w))
-    for col in range(0, im_w - w):
-        for row in range(0, im_h - h):
-            cropped_im = image[row:row + h, col:col + w, :]
-            cropped_v = cropped_im.flatten()
-
-            if op['distance'] == 'euclidean':
-                heatmap[row, col] = scipy.spatial.distance.euclidean(template_v, cropped_v)
-            elif op['distance'] == 'correlation':
-                heatmap[row, col] = scipy.spatial.distance.correlation(template_v, cropped_v)
+    backend = op['backend']
+    if op['distance'] not in backends.DISTANCES:
+        backend = 'loop'
+    heatmap = backends.match(template, image, op['distance'], backend)
 
     # normalize
-    if op['normalize']:
+    if op['normalize'] and op['relative']:
         heatmap /= heatmap.max()
 
     # size
@@ -143,6 +579,8 @@ def match_template_opencv(template, image, options):
         - distance: Distance measure to use. (euclidean | correlation | ccoeff).
             Default: 'correlation'
         - normalize: Heatmap values will be in the range of 0 to 1. Default: True
+        - relative: Heatmap values are relative to the worst match in the image. If False,
+            absolute distances are kept, to compare scores of different templates. Default: True
         - retain_size: Whether to retain the same size as input image. Default: True
     :return: Heatmap
     """
@@ -170,9 +608,9 @@ def match_template_opencv(template, image, options):
 
     # make minimum peak heatmap
     if method not in [cv.TM_SQDIFF, cv.TM_SQDIFF_NORMED]:
-        heatmap = heatmap.max() - heatmap
+        heatmap = heatmap.max() - heatmap if op['relative'] else 1 - heatmap
 
-    if op['normalize']:
+    if op['normalize'] and op['relative']:
         heatmap /= heatmap.max()
 
     # size
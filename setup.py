@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='cv_utils',
@@ -16,5 +16,8 @@ setup(
         "Topic :: Utilities"
     ],
     requires=['numpy', 'cv2', 'matplotlib', 'scipy', 'skimage'],
-    license='LICENSE.txt'
+    license='LICENSE.txt',
+    entry_points={
+        'console_scripts': ['cv-utils = cv_utils.cli:main']
+    }
 )
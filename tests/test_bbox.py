@@ -0,0 +1,96 @@
+import pickle
+
+import pytest
+
+from cv_utils import Box, ViewBox, Label
+
+
+def test_cluster_boxes():
+    boxes = [Box(0, 0, 10, 10), Box(50, 50, 10, 10), Box(5, 5, 10, 10), Box(12, 12, 10, 10),
+             Box(10, 30, 5, 5)]
+    clusters = Box.cluster_boxes(boxes)
+
+    assert clusters == [Box(0, 0, 22, 22), Box(10, 30, 5, 5), Box(50, 50, 10, 10)]
+
+
+def test_cluster_boxes_threshold():
+    boxes = [Box(0, 0, 10, 10), Box(9, 0, 10, 10)]
+
+    assert len(Box.cluster_boxes(boxes, 0.05)) == 1
+    assert len(Box.cluster_boxes(boxes, 0.5)) == 2
+
+
+def test_left_right_most():
+    boxes = [Box(5, 0, 1, 1), Box(1, 0, 1, 1), Box(9, 0, 1, 1), Box(3, 0, 1, 1)]
+
+    assert Box.left_most(boxes).x == 1
+    assert Box.right_most(boxes).x == 9
+    assert [b.x for b in Box.left_most(boxes, 2)] == [1, 3]
+    assert [b.x for b in Box.right_most(boxes, 2)] == [9, 5]
+
+
+class _CountingList(list):
+    """ List counting the item reads, to check how many boxes an algorithm visits """
+    reads = 0
+
+    def __getitem__(self, i):
+        self.reads += 1
+        return list.__getitem__(self, i)
+
+
+def test_cluster_boxes_stacked_column():
+    # text lines: same x-range, not overlapping in y
+    boxes = _CountingList(Box(0, 10 * i, 100, 8) for i in range(2000))
+    boxes.append(Box(50, 4, 10, 10))
+
+    clusters = Box.cluster_boxes(boxes)
+
+    # an x-only sweep line would visit all the pairs of the column (about 2M reads)
+    assert boxes.reads <= 10 * len(boxes)
+    assert len(clusters) == 1999
+    assert clusters[0] == Box(0, 0, 100, 18)
+
+
+def test_box_value_semantics():
+    box = Box(1, 2, 3, 4)
+    assert box == Box(1, 2, 3, 4) and box != Box(1, 2, 3, 5)
+    assert box != (1, 2, 3, 4)
+    assert len({box, Box(1, 2, 3, 4), Box(1.0, 2.0, 3.0, 4.0)}) == 1
+    assert {box: 'a'}[Box(1, 2, 3, 4)] == 'a'
+
+    with pytest.raises(AttributeError):
+        box.x = 5
+    with pytest.raises(AttributeError):
+        del box.width
+    assert hash(box) == hash(Box(1, 2, 3, 4))
+
+    label = Label((10, 20), 'a')
+    assert {label: 1}[Label([10, 20], 'a')] == 1
+    with pytest.raises(AttributeError):
+        label.text = 'b'
+
+    # display attributes of a ViewBox can change, its co-ordinates can not
+    vbox = ViewBox(box)
+    vbox.color = [0, 0, 255]
+    with pytest.raises(AttributeError):
+        vbox.x = 0
+
+
+def test_pickle():
+    vbox = ViewBox(Box(1, 2, 3, 4), [0, 255, 0], [Label((10, 20), 'a', 90)], 2)
+    for obj in (Box(1, 2.5, 3, 4), vbox, vbox.labels[0]):
+        res = pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+        assert type(res) is type(obj) and res == obj and repr(res) == repr(obj)
+
+    res = pickle.loads(pickle.dumps(vbox))
+    assert (res.color, res.labels, res.thickness) == (vbox.color, vbox.labels, vbox.thickness)
+    with pytest.raises(AttributeError):
+        res.y = 0
+
+
+def test_to_int():
+    vbox = ViewBox(Box(1.4, 2.6, 3.3, 4.5), [0, 255, 0])
+    res = vbox.to_int()
+    assert type(res) is Box
+    assert res == Box(1, 3, 4, 4)
+    assert all(isinstance(v, int) for v in res.to_tup())
@@ -0,0 +1,42 @@
+import numpy as np
+
+from cv_utils import Box, ViewBox, Label, box_store, img_utils, COL_RED
+
+
+def test_save_load(tmp_path):
+    boxes = [Box(1, 2, 3, 4),
+             ViewBox(Box(5.5, 6, 7, 8), COL_RED, [Label((0, 1), 'a'), Label((50, 50), u'été', 90)], 2),
+             ViewBox(Box(0, 0, 1, 1))]
+    path = str(tmp_path / 'store')
+    box_store.save(path, boxes)
+
+    for mmap in (True, False):
+        store = box_store.load(path, mmap)
+        assert len(store) == 3
+        assert np.array_equal(store.boxes, [box.to_tup() for box in boxes])
+
+        loaded = list(store)
+        assert type(loaded[0]) is Box and loaded[0] == boxes[0]
+        for vbox, res in zip(boxes[1:], loaded[1:]):
+            assert res == vbox
+            assert (res.color, res.labels, res.thickness) == (vbox.color, vbox.labels, vbox.thickness)
+        assert store[-1] == boxes[-1]
+        assert store[1:] == loaded[1:]
+
+
+def test_integer_coordinates(tmp_path):
+    img = np.arange(20 * 20, dtype=np.uint8).reshape(20, 20)
+    path = str(tmp_path / 'store')
+    box_store.save(path, [Box(2, 3, 10, 10), ViewBox(Box(1, 1, 4, 4), labels=[Label((5, 6), 'a')])])
+
+    store = box_store.load(path)
+    assert store.boxes.dtype == np.int64
+    assert np.array_equal(img_utils.img_box(img, store[0]), img[3:13, 2:12])
+    assert all(isinstance(v, int) for v in store[1].labels[0].pos)
+
+    # overwritten with float boxes
+    box_store.save(path, [Box(2, 3, 10, 10), Box(0.5, 0, 1, 1)])
+    store = box_store.load(path)
+    assert len(store) == 2 and store.boxes.dtype == np.float64
+    assert np.array_equal(img_utils.img_box(img, store[0]), img[3:13, 2:12])
+    assert store[1] == Box(0.5, 0, 1, 1)
@@ -0,0 +1,53 @@
+import json
+
+from cv_utils import cli
+
+TEMPLATE = 'tests/resources/kelloggs-red-fruit.jpg'
+IMAGE = 'tests/resources/sch-image.jpg'
+
+
+def _records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_list_images():
+    files = cli.list_images(['tests/resources', 'tests/resources/sch-*.jpg'])
+    assert IMAGE in files and TEMPLATE in files
+    assert files == sorted(set(files))
+
+
+def test_match_options():
+    args = cli.parse_args(['match', '-t', TEMPLATE, IMAGE])
+    assert cli.match_options(args) == dict(distance='correlation', normalize=True, feature='rgb')
+
+    args = cli.parse_args(['match', '-t', TEMPLATE, '-f', 'hog', '-f', 'lab', '--no-normalize', IMAGE])
+    op = cli.match_options(args)
+    assert [f['feature'] for f in op['features']] == ['hog', 'lab']
+    assert not op['normalize']
+
+
+def test_match_resume(tmp_path):
+    out = str(tmp_path / 'results.jsonl')
+    assert cli.main(['match', '-w', '1', '-t', TEMPLATE, '-o', out, IMAGE]) == 0
+    records = _records(out)
+    assert len(records) == 1 and 'box' in records[0]
+    assert cli.completed(out) == {(IMAGE, TEMPLATE)}
+
+    # interrupted run: partial last line
+    with open(out, 'a') as f:
+        f.write('{"file": ')
+    assert cli.completed(out) == {(IMAGE, TEMPLATE)}
+
+    assert cli.main(['match', '-w', '1', '-t', TEMPLATE, '-o', out, '--resume', IMAGE, TEMPLATE]) == 0
+    assert cli.completed(out) == {(IMAGE, TEMPLATE), (TEMPLATE, TEMPLATE)}
+
+
+def test_match_errors(tmp_path):
+    out = str(tmp_path / 'results.jsonl')
+    # the image is larger than the template searched in
+    assert cli.main(['match', '-w', '1', '-t', IMAGE, '-o', out, TEMPLATE, IMAGE]) == 0
+
+    records = {rec['file']: rec for rec in _records(out)}
+    assert 'error' in records[TEMPLATE] and 'box' not in records[TEMPLATE]
+    assert 'box' in records[IMAGE]
@@ -0,0 +1,32 @@
+from __future__ import division
+
+import numpy as np
+
+from cv_utils import Box, evaluation
+
+
+def test_iou_matrix():
+    boxes1 = [Box(0, 0, 10, 10), Box(5, 5, 10, 10), Box(30, 30, 0, 0)]
+    boxes2 = [Box(0, 0, 10, 10), Box(8, 0, 10, 20)]
+
+    iou = evaluation.iou_matrix(boxes1, boxes2)
+    expected = [[Box.iou(b1, b2) for b2 in boxes2] for b1 in boxes1]
+    assert np.allclose(iou, expected)
+
+
+def test_evaluator():
+    gt = [Box(0, 0, 10, 10), Box(50, 50, 10, 10)]
+    pred = [Box(1, 1, 10, 10), Box(0, 0, 10, 10), Box(100, 100, 5, 5)]
+
+    # greedy: the best score takes the ground truth box first (precision 1)
+    # hungarian: the exact box takes it, after a false positive (precision 1/2)
+    for method, ap in [('greedy', 1 / 3), ('hungarian', 1 / 6)]:
+        ev = evaluation.Evaluator(iou_thresholds=[0.5], method=method)
+        ev.add(pred, [0.9, 0.8, 0.7], gt)
+        ev.add([], [], [Box(0, 0, 5, 5)])
+
+        precision, recall, _ = ev.precision_recall(0.5)
+        # one true positive out of 3 ground truth boxes, at the best score
+        assert recall.max() == 1 / 3
+        assert np.isclose(ev.average_precision()[0.5], ap)
+        assert np.isclose(ev.mean_average_precision()[0], ap)
@@ -0,0 +1,52 @@
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+from cv_utils import feature_extractor as fe
+
+
+image = cv.imread('tests/resources/sch-image.jpg')
+
+
+def test_context_memoizes():
+    ctx = fe.FeatureContext(image)
+    assert fe.gray(ctx) is fe.gray(ctx)
+    assert fe.lab(ctx) is ctx.color(cv.COLOR_BGR2LAB)
+
+    ctx.release()
+    assert fe.lab(ctx) is not None
+
+
+def test_projection(tmpdir):
+    rng = np.random.RandomState(0)
+    # 16 channels spanned by 3 directions
+    feat = rng.rand(40, 50, 3).dot(rng.rand(3, 16))
+
+    proj = fe.Projection.fit([feat], 3)
+    assert proj.variance_retained > 0.999
+    assert proj.transform(feat).shape == (40, 50, 3)
+
+    path = str(tmpdir.join('proj.npz'))
+    proj.save(path)
+    assert np.allclose(fe.projection(path).transform(feat), proj.transform(feat))
+
+
+def test_projection_fit_samples():
+    rng = np.random.RandomState(0)
+    feats = [rng.rand(30, 40, 8).astype(np.float32) for _ in range(3)]
+
+    # sampling per map selects the same pixels as sampling their concatenation
+    proj = fe.Projection.fit(feats, 2, max_samples=500, seed=1)
+    samples = np.concatenate([f.reshape(-1, 8) for f in feats]).astype(np.float64)
+    index = np.random.RandomState(1).choice(len(samples), 500, replace=False)
+    assert np.allclose(proj.mean, samples[index].mean(axis=0))
+
+    tracemalloc.start()
+    try:
+        fe.Projection.fit(feats * 10, 2, max_samples=100)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # far below the float64 copy of all the maps
+    assert peak < len(samples) * 10 * 8 * 8 / 4
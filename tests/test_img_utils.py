@@ -1,7 +1,10 @@
+from __future__ import division
+
 import cv2 as cv
+import numpy as np
 
 import cv_utils
-from cv_utils import img_utils
+from cv_utils import Box, img_utils
 
 
 def test_remove_bg():
@@ -36,3 +39,94 @@ def test_add_bg():
     img_res = img_utils.add_bg(img, 50, cv_utils.COL_YELLOW)
     h, w, d = img.shape
     assert img_res.shape == (h + 2*50, w + 2*50, d)
+
+
+def test_imread_max_side():
+    img = img_utils.imread('tests/resources/sch-image.jpg', 300)
+    h, w = cv.imread('tests/resources/sch-image.jpg').shape[:2]
+
+    assert img_utils.jpeg_size('tests/resources/sch-image.jpg') == (h, w)
+    assert max(img.shape[:2]) == 300
+    assert abs(img.shape[0] / img.shape[1] - h / w) < 0.01
+
+    # unreadable files
+    assert img_utils.imread('tests/resources/missing.jpg', 300) is None
+    assert img_utils.imread('tests/resources/missing.jpg') is None
+
+
+def _write_video(fname, n_frames=30, fps=10):
+    """ Video of a white square moving right by a pixel per frame """
+    writer = cv.VideoWriter(fname, cv.VideoWriter_fourcc(*'MJPG'), fps, (64, 48))
+    for i in range(n_frames):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[10:20, i:i + 10] = 255
+        writer.write(frame)
+    writer.release()
+
+
+def test_each_frame(tmp_path):
+    fname = str(tmp_path / 'video.avi')
+    _write_video(fname)
+
+    frames = [(index, t) for _, index, t in img_utils.each_frame(fname, stride=3, start=1.0)]
+    assert [index for index, _ in frames] == list(range(10, 30, 3))
+    assert abs(frames[0][1] - 1.0) < 1e-6
+
+    frames = list(img_utils.each_frame(fname, end=0.5, buffer_size=1))
+    assert len(frames) == 5
+
+
+def test_crop_many():
+    img = np.arange(20 * 30 * 3, dtype=np.uint8).reshape(20, 30, 3)
+    boxes = [Box(0, 0, 5, 4), Box(10, 12, 5, 4), Box(-2, 18, 5, 4)]
+
+    crops = img_utils.crop_many(img, boxes)
+    assert crops.shape == (3, 4, 5, 3)
+    assert np.array_equal(crops[1], img_utils.img_box(img, boxes[1]))
+    # outside the image is background
+    assert np.array_equal(crops[2][:2, 2:], img[18:20, 0:3])
+    assert not crops[2][:, :2].any() and not crops[2][2:].any()
+
+    resized = img_utils.crop_many(img, boxes + [Box(0, 0, 10, 8)], out_size=(10, 8))
+    assert resized.shape == (4, 8, 10, 3)
+    assert np.array_equal(resized[3], img[:8, :10])
+
+    canvas = np.zeros_like(img)
+    img_utils.set_img_boxes(canvas, boxes, crops)
+    for box in boxes:
+        assert np.array_equal(img_utils.img_box(canvas, box), img_utils.img_box(img, box))
+
+
+def test_pad():
+    img = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+
+    res = img_utils.pad(img, [1, 2, 3, 4], cv_utils.COL_YELLOW)
+    assert res.shape == (8, 11, 3) and res.dtype == np.uint8
+    assert np.array_equal(res[1:5, 4:9], img)
+    assert (res[0] == cv_utils.COL_YELLOW).all() and (res[:, -2:] == cv_utils.COL_YELLOW).all()
+
+    # padding into a buffer, same result
+    out = np.zeros_like(res)
+    assert img_utils.pad(img, [1, 2, 3, 4], cv_utils.COL_YELLOW, out) is out
+    assert np.array_equal(out, res)
+
+    batch = img_utils.pad_many(np.stack([img, img + 1]), 2)
+    assert batch.shape == (2, 8, 9, 3)
+    assert np.array_equal(batch[1], img_utils.pad(img + 1, 2))
+    assert np.array_equal(img_utils.pad_many([img[:, :, 0]], 2)[0], img_utils.pad(img[:, :, 0], 2))
+
+
+def test_pad_channels():
+    bgra = np.full((4, 5, 4), 7, dtype=np.uint8)
+    res = img_utils.pad(bgra, 1, cv_utils.COL_YELLOW)
+    assert res.shape == (6, 7, 4)
+    assert list(res[0, 0]) == cv_utils.COL_YELLOW + [0]
+
+    # output buffer and batch paths, the color is filled with 0 like copyMakeBorder
+    out = np.empty_like(res)
+    assert np.array_equal(img_utils.pad(bgra, 1, cv_utils.COL_YELLOW, out), res)
+    batch = img_utils.pad_many(np.stack([bgra, bgra]), 1, cv_utils.COL_YELLOW)
+    assert np.array_equal(batch[1], res)
+
+    feat = img_utils.pad(np.ones((5, 5, 8)), 1)
+    assert feat.shape == (7, 7, 8) and feat[0].sum() == 0 and feat[1:6, 1:6].min() == 1
@@ -0,0 +1,61 @@
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cv_utils import matching_backends as backends, feature_extractor as fe
+
+
+rng = np.random.RandomState(0)
+image = rng.rand(30, 40, 6)
+template = image[10:18, 5:15] + rng.rand(8, 10, 6) * 0.1
+
+
+def test_backends_match_reference():
+    for distance in backends.DISTANCES:
+        ref = backends.get('loop')(template, image, distance)
+        for name in backends.names(tunable_only=True):
+            hmap = backends.get(name)(template, image, distance)
+            assert hmap.shape == (30 - 8 + 1, 40 - 10 + 1)
+            assert np.allclose(hmap, ref, atol=1e-4)
+
+
+def test_autotuner_persists(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    backends.Autotuner(path).match(template, image, 'correlation')
+
+    tuner = backends.Autotuner(path)
+    assert list(tuner.choices.values())[0] in backends.names(tunable_only=True)
+
+
+def test_autotuner_threads(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    tuner = backends.Autotuner(path)
+
+    # every thread tunes a new input size at once
+    def tune(i):
+        return tuner.match(template, image[:, :20 + i], 'euclidean').shape
+
+    with ThreadPoolExecutor(8) as pool:
+        shapes = list(pool.map(tune, range(16)))
+
+    assert shapes == [(23, 11 + i) for i in range(16)]
+    assert len(backends.Autotuner(path).choices) == 16
+    assert tmpdir.listdir() == [tmpdir.join('tuning.json')]
+
+
+def test_quantized_memory():
+    rng = np.random.RandomState(0)
+    feat = rng.rand(200, 200, 32)
+    q_image, q_template = fe.quantize(feat), fe.quantize(feat[50:80, 60:100])
+
+    # no backend, nor the autotuner running all of them, dequantizes the whole map
+    fns = [backends.get(name) for name in backends.names(tunable_only=True)]
+    for fn in fns + [backends.Autotuner().match]:
+        tracemalloc.start()
+        try:
+            fn(q_template, q_image, 'correlation')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < feat.nbytes / 2
@@ -0,0 +1,25 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+
+from cv_utils import template_matching as tm
+from cv_utils.shared_features import SharedFeatures
+
+
+template = cv.imread('tests/resources/kelloggs-red-fruit.jpg')
+image = cv.imread('tests/resources/sch-image.jpg')
+options = dict(features=[dict(feature='lab'), dict(feature='rgb', quantize='uint8')])
+
+
+def _match(handle):
+    return tm.match_one(template, handle, options)
+
+
+def test_match_in_workers():
+    box, score = tm.match_one(template, image, options)
+
+    with SharedFeatures(image, options) as shared:
+        with ProcessPoolExecutor(2) as pool:
+            results = list(pool.map(_match, [shared.handle()] * 2))
+
+    assert all(r == (box, score) for r in results)
@@ -0,0 +1,25 @@
+import cv2 as cv
+import numpy as np
+
+from cv_utils import synthetic, img_utils
+
+
+template = cv.imread('tests/resources/kelloggs-red-fruit.jpg')
+
+
+def test_generate_places_template():
+    op = dict(rotate=False, contrast=None, brightness=None, noise=0)
+    images, boxes, ids = synthetic.generate(template, 4, (400, 300), seed=1, options=op)
+
+    assert images.shape == (4, 400, 300, 3)
+    for img, box in zip(images, boxes):
+        assert np.array_equal(img_utils.img_box(img, box), template)
+
+
+def test_batches_reproducible():
+    a = next(synthetic.batches(template, (400, 400), 3, seed=7))
+    b = list(synthetic.batches(template, (400, 400), 3, n_batches=2, seed=7))
+
+    assert len(b) == 2
+    assert np.array_equal(a[0], b[0][0])
+    assert a[1] == b[0][1]
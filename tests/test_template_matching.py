@@ -1,6 +1,10 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2 as cv
+import numpy as np
 
-from cv_utils import template_matching as tm
+from cv_utils import template_matching as tm, img_utils, async_matching, feature_extractor as fe
 
 
 template = cv.imread('tests/resources/kelloggs-red-fruit.jpg')
@@ -36,3 +40,111 @@ def test_multi_feat_match():
 
     assert scale == 1
     assert hmap.shape == image.shape[:2]
+
+
+def test_match_rotated():
+    box, _ = tm.match_one(template, image)
+    rotated = img_utils.rotate(template, 90)
+
+    r_box, _, angle = tm.match_rotated(rotated, image)
+
+    assert angle == 270
+    assert r_box == box
+
+
+def test_async_match_one():
+    box, _ = tm.match_one(template, image)
+
+    async def run():
+        matcher = async_matching.AsyncMatcher(concurrency=2)
+        return await asyncio.gather(*[matcher.match_one(template, image) for _ in range(3)])
+
+    results = asyncio.run(run())
+    assert all(r_box == box for r_box, _ in results)
+
+
+def test_result_cache():
+    cache = tm.enable_cache()
+    try:
+        box, score = tm.match_one(template, image)
+        c_box, c_score = tm.match_one(template.copy(), image, dict(feature='rgb'))
+    finally:
+        tm.disable_cache()
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert (c_box, c_score) == (box, score)
+
+
+def test_result_cache_threads(tmpdir):
+    cache = tm.MatchCache(path=str(tmpdir))
+    result = ((1, 2, 3, 4), 0.5)
+
+    # every thread stores the same key at once, readers must never see a partial file
+    def put_get(i):
+        cache.put('samekey', result)
+        return tm.MatchCache(path=str(tmpdir)).get('samekey')
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(put_get, range(400)))
+
+    assert all(r == result for r in results)
+    assert tmpdir.listdir() == [tmpdir.join('samekey')]
+
+
+def test_match_template_quantized():
+    rng = np.random.RandomState(0)
+    img_f = rng.rand(60, 80, 9)
+    tmpl_f = img_f[20:35, 30:50].copy()
+
+    hmap = tm.match_template(tmpl_f, img_f, dict(retain_size=False))
+    for quantize in ['uint8', 'float16']:
+        q_hmap = tm.match_template(fe.quantize(tmpl_f, quantize), fe.quantize(img_f, quantize),
+                                   dict(retain_size=False))
+        assert q_hmap.argmin() == hmap.argmin()
+        assert np.abs(q_hmap - hmap).max() < 0.05
+
+
+def test_match_one_roi():
+    box, _ = tm.match_one(template, image)
+
+    roi_box, _ = tm.match_one(template, image, roi=box.padding(20))
+    assert roi_box == box
+
+    region = tm.search_region(image.shape, template.shape, box, dict(feature='hog'))
+    assert region.x % 8 == 0 and region.y % 8 == 0
+    assert region.width % 8 == 0 and region.height % 8 == 0
+
+
+def test_feature_match_roi_scale():
+    op = dict(feature='hog')
+    box, _ = tm.match_one(template, image, op)
+
+    # same scale and same match, whatever the padding of the roi
+    matches = set()
+    for px in (0, 3, 13, 37):
+        roi = box.padding(px)
+        heatmap, scale = tm.feature_match(template, image, op, roi=roi)
+        region = tm.search_region(image.shape, template.shape, roi, op)
+        assert scale == 8 and heatmap.shape == (region.height // 8, region.width // 8)
+        matches.add(tm._best_match(heatmap, scale, 0, 0)[0].move(region.top_left()))
+    assert len(matches) == 1
+    match = matches.pop()
+    assert abs(match.x - box.x) < 8 and abs(match.y - box.y) < 8
+
+
+def test_match_video(tmp_path):
+    fname = str(tmp_path / 'video.avi')
+    writer = cv.VideoWriter(fname, cv.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+    for i in range(20):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[10:30, i + 8:i + 28] = (0, 128, 255)
+        frame[15:25, i + 13:i + 23] = 255
+        writer.write(frame)
+    writer.release()
+
+    template = np.zeros((28, 28, 3), dtype=np.uint8)
+    template[4:24, 4:24] = (0, 128, 255)
+    template[9:19, 9:19] = 255
+
+    for box, _, index, _ in tm.match_video(template, fname, track=True, stride=2):
+        assert abs(box.x - (index + 4)) <= 1 and abs(box.y - 6) <= 1